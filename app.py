@@ -1,13 +1,19 @@
 from qtpy.QtWidgets import QMainWindow, QTextEdit, QDockWidget, QVBoxLayout, \
     QPushButton, QWidget, QScrollArea, QToolBar, QPushButton, QAction, \
-    QFileDialog, QListWidget, QListWidgetItem
-from qtpy.QtCore import Qt, QFile
-from qtpy.QtGui import QIcon, QImageReader, QPixmap, QKeySequence
+    QFileDialog, QListWidget, QListWidgetItem, QListView
+from qtpy.QtCore import Qt, QFile, QFileSystemWatcher, QTimer
+from qtpy.QtGui import QIcon, QImageReader, QPixmap, QKeySequence, QTransform
 
 import os
 import sys
-import glob
 from widgets.canvas import Canvas
+from widgets.file_list_model import FileListModel, natural_key
+from widgets.object_list_model import ObjectListModel
+from widgets.label_list_model import LabelListModel
+from widgets.dir_scanner import DirScanner
+from image_cache import PREFETCH
+from label_files import label_path
+from label_index import LabelIndex
 
 class MainWindow(QMainWindow):
     FIT_WINDOW, FIT_WIDTH, MANUAL_ZOOM = 0, 1, 2
@@ -19,27 +25,51 @@ class MainWindow(QMainWindow):
 
         self.file_dirs = []
         self.file_id = -1
-        self.labels = []
-        with open(label_file, 'r') as f:
-            lines = f.read().splitlines()
-            for label in lines:
-                self.labels.append(label)
+        # label files in the label store, if the app uses one
+        self.stored_labels = set()
+        self.dir_scanner = DirScanner()
+        self.dir_scanner.found.connect(self.files_found)
+        self.dir_scanner.finished.connect(self.scan_finished)
+        self.file_watcher = QFileSystemWatcher(self)
+        self.file_watcher.directoryChanged.connect(self.schedule_rescan)
+        self.rescan_timer = QTimer(self)
+        self.rescan_timer.setSingleShot(True)
+        self.rescan_timer.setInterval(200)
+        self.rescan_timer.timeout.connect(self.rescan_labels)
+        # watched path -> directory, directory -> label file names last seen
+        self.watched = {}
+        self.label_names = {}
+        self.changed_dirs = set()
 
         # RIGHT DOCK
         self.label_dock = QDockWidget("Label List", self)
-        self.label_list_widget = QListWidget(self)
+        self.label_list_model = LabelListModel(self)
+        self.label_list_view = QListView(self)
+        self.label_list_view.setUniformItemSizes(True)
+        self.label_list_view.setLayoutMode(QListView.Batched)
+        self.label_list_view.setModel(self.label_list_model)
         self.load_labels(label_file)
-        self.label_dock.setWidget(self.label_list_widget)
+        self.label_dock.setWidget(self.label_list_view)
 
         self.object_dock = QDockWidget("Object List", self)
-        self.object_list_widget = QListWidget(self)
-        self.object_list_widget.currentRowChanged.connect(self.change_object)
-        self.object_dock.setWidget(self.object_list_widget)
+        self.object_list_model = ObjectListModel(self)
+        self.object_list_view = QListView(self)
+        self.object_list_view.setUniformItemSizes(True)
+        self.object_list_view.setModel(self.object_list_model)
+        self.object_list_view.selectionModel().currentRowChanged.connect(
+            lambda current, previous: self.change_object(current.row()))
+        self.object_list_view.doubleClicked.connect(lambda index: self.canvas.relabel_obj(index.row()))
+        self.object_dock.setWidget(self.object_list_view)
 
         self.file_dock = QDockWidget("File List", self)
-        self.file_list_widget = QListWidget(self)
-        self.file_list_widget.currentRowChanged.connect(self.change_file)
-        self.file_dock.setWidget(self.file_list_widget)
+        # file_dirs and which of them have a label file
+        self.file_list_model = FileListModel(self)
+        self.file_list_view = QListView(self)
+        self.file_list_view.setUniformItemSizes(True)
+        self.file_list_view.setModel(self.file_list_model)
+        self.file_list_view.selectionModel().currentRowChanged.connect(
+            lambda current, previous: self.change_file(current.row()))
+        self.file_dock.setWidget(self.file_list_view)
 
         self.addDockWidget(Qt.RightDockWidgetArea, self.label_dock)
         self.addDockWidget(Qt.RightDockWidgetArea, self.object_dock)
@@ -63,6 +93,8 @@ class MainWindow(QMainWindow):
         self.open_action.setShortcut(QKeySequence("Ctrl+O"))
         self.open_dir_action = QAction(QIcon('icons/open.png'), 'Open Dir', self)
         self.open_dir_action.triggered.connect(self.open_dir)
+        self.open_dir_recursive_action = QAction(QIcon('icons/open.png'), 'Open Dir Tree', self)
+        self.open_dir_recursive_action.triggered.connect(lambda: self.open_dir(recursive=True))
 
         self.next_img_action = QAction(QIcon('icons/next.png'), 'Next Image', self)
         self.next_img_action.triggered.connect(self.next_img)
@@ -78,12 +110,19 @@ class MainWindow(QMainWindow):
         self.zoom_org_action = QAction(QIcon('icons/fit-window.png'), 'Fit Window', self)
         self.zoom_org_action.triggered.connect(self.zoom_org)
 
+        self.select_action = QAction(QIcon('icons/edit.png'), 'Select', self)
+        self.select_action.triggered.connect(self.select_mode)
+        self.select_action.setShortcut(QKeySequence("Esc"))
         self.rectangle_action = QAction(QIcon('icons/objects.png'), 'New Rectangle', self)
         self.rectangle_action.triggered.connect(self.new_rectangle)
         self.auto_polygon_action = QAction(QIcon('icons/objects.png'), 'New Auto-Polygon', self)
         self.auto_polygon_action.triggered.connect(self.new_auto_polygon)
         self.polygon_action = QAction(QIcon('icons/objects.png'), 'New Polygon', self)
         self.polygon_action.triggered.connect(self.new_polygon)
+        self.auto_segment_action = QAction(QIcon('icons/objects.png'), 'New Auto-Segment', self)
+        self.auto_segment_action.triggered.connect(self.new_auto_segment)
+        self.auto_segment_page_action = QAction(QIcon('icons/objects.png'), 'Auto-Segment Page', self)
+        self.auto_segment_page_action.triggered.connect(self.canvas.auto_segment_page)
 
         self.next_obj_action = QAction(QIcon('icons/next.png'), 'Next Object', self)
         self.next_obj_action.triggered.connect(self.canvas.next_obj)
@@ -94,22 +133,36 @@ class MainWindow(QMainWindow):
         self.del_obj_action = QAction(QIcon('icons/delete.png'), 'Delete Object', self)
         self.del_obj_action.triggered.connect(self.canvas.del_obj)
         self.del_obj_action.setShortcut(QKeySequence("Del"))
+        self.undo_action = QAction(QIcon('icons/undo.png'), 'Undo', self)
+        self.undo_action.triggered.connect(self.canvas.undo)
+        self.undo_action.setShortcut(QKeySequence.Undo)
+        # the undo arrow mirrored
+        redo_icon = QIcon(QPixmap('icons/undo.png').transformed(QTransform().scale(-1, 1)))
+        self.redo_action = QAction(redo_icon, 'Redo', self)
+        self.redo_action.triggered.connect(self.canvas.redo)
+        self.redo_action.setShortcut(QKeySequence.Redo)
 
         self.toolbar = QToolBar(self)
         self.toolbar.setToolButtonStyle(Qt.ToolButtonTextUnderIcon)
         self.toolbar.addAction(self.open_action)
         self.toolbar.addAction(self.open_dir_action)
+        self.toolbar.addAction(self.open_dir_recursive_action)
         self.toolbar.addAction(self.next_img_action)
         self.toolbar.addAction(self.prev_img_action)
         # self.toolbar.addAction(self.zoom_in_action)
         # self.toolbar.addAction(self.zoom_out_action)
         # self.toolbar.addAction(self.zoom_org_action)
+        self.toolbar.addAction(self.select_action)
         self.toolbar.addAction(self.rectangle_action)
         self.toolbar.addAction(self.auto_polygon_action)
         self.toolbar.addAction(self.polygon_action)
+        self.toolbar.addAction(self.auto_segment_action)
+        self.toolbar.addAction(self.auto_segment_page_action)
         self.toolbar.addAction(self.next_obj_action)
         self.toolbar.addAction(self.prev_obj_action)
         self.toolbar.addAction(self.del_obj_action)
+        self.toolbar.addAction(self.undo_action)
+        self.toolbar.addAction(self.redo_action)
 
         self.addToolBar(Qt.LeftToolBarArea, self.toolbar)
 
@@ -123,16 +176,24 @@ class MainWindow(QMainWindow):
     def update_mode(self, mode_id):
         pass
 
+    def closeEvent(self, event):
+        self.canvas.flush_labels()
+        self.canvas.label_writer.wait()
+        super(MainWindow, self).closeEvent(event)
+
     def change_object(self, row):
         if (row >= 0):
             self.canvas.cur_object = row
-            self.canvas.repaint()
+            self.canvas.update()
 
     def change_file(self, row):
-        if (row >= 0):
+        # rows also change when the list is rebuilt or synced to file_id,
+        # the current file is already loaded then
+        if (row >= 0 and row != self.file_id):
             self.file_id = row
             self.canvas.load_file(self.file_dirs[self.file_id])
             self.adjustScale(initial=True)
+            self.prefetch()
 
     def open_file(self):
         path = '.'
@@ -148,65 +209,159 @@ class MainWindow(QMainWindow):
         self.file_dirs = [file_dir]
         self.import_files()
 
-    def open_dir(self):
+    def open_dir(self, recursive=False):
         targetDirPath = str(QFileDialog.getExistingDirectory(
             self, 'Open Directory', '.',
             QFileDialog.ShowDirsOnly | QFileDialog.DontResolveSymlinks))
-
+        if targetDirPath:
+            self.scan_dir(targetDirPath, recursive)
+
+    def scan_dir(self, dir_path, recursive=False):
+        # the list fills in while the directory is read, the first image
+        # found opens right away
+        if self.canvas.label_store is not None:
+            self.stored_labels = self.canvas.label_store.labelled()
         self.file_dirs = []
-        for fmt in QImageReader.supportedImageFormats():
-            pattern = os.path.join(targetDirPath, "*." + fmt.data().decode())
-            self.file_dirs += glob.glob(pattern)
-        self.import_files()
+        self.file_id = -1
+        self.file_list_model.set_files(self.file_dirs)
+        exts = [fmt.data().decode().lower() for fmt in QImageReader.supportedImageFormats()]
+        self.dir_scanner.scan(dir_path, exts, recursive)
+
+    def files_found(self, generation, images, labels):
+        if generation != self.dir_scanner.generation:
+            return
+        self.file_list_model.append_files(images)
+        if self.canvas.label_store is not None:
+            # label files next to the images are not used with a store
+            labels = [label_dir for label_dir in map(label_path, images) if label_dir in self.stored_labels]
+        for label_dir in labels:
+            self.file_list_model.set_labelled(label_dir)
+        if self.file_id == -1 and len(self.file_dirs) > 0:
+            self.file_id = 0
+            self.canvas.load_file(self.file_dirs[0])
+            self.adjustScale(initial=True)
+            self.select_file(self.file_id)
+
+    def scan_finished(self, generation, label_names):
+        if generation != self.dir_scanner.generation or len(self.file_dirs) == 0:
+            return
+        current = self.file_dirs[self.file_id]
+        self.file_dirs = sorted(self.file_dirs, key=natural_key)
+        self.file_list_model.set_files(self.file_dirs, self.file_list_model.labelled)
+        self.file_id = self.file_dirs.index(current)
+        self.select_file(self.file_id)
+        self.prefetch()
+        if self.canvas.label_store is not None:
+            self.canvas.label_store.add_images(self.file_dirs)
+        else:
+            self.watch_dirs(label_names)
+
+    def select_file(self, row):
+        self.file_list_view.setCurrentIndex(self.file_list_model.index(row))
 
     def next_img(self):
         if (len(self.file_dirs) > 0):
             self.file_id = (self.file_id + 1) % len(self.file_dirs)
             self.canvas.load_file(self.file_dirs[self.file_id])
             self.adjustScale(initial=True)
-            self.file_list_widget.setCurrentRow(self.file_id)
+            self.select_file(self.file_id)
+            self.prefetch()
 
     def prev_img(self):
         if (len(self.file_dirs) > 0):
             self.file_id = (self.file_id + len(self.file_dirs) - 1) % len(self.file_dirs)
             self.canvas.load_file(self.file_dirs[self.file_id])
             self.adjustScale(initial=True)
-            self.file_list_widget.setCurrentRow(self.file_id)
+            self.select_file(self.file_id)
+            self.prefetch()
 
     def import_files(self):
         self.load_file_list()
+        if len(self.file_dirs) == 0:
+            return
 
         self.file_id = 0
         self.canvas.load_file(self.file_dirs[0])
         self.adjustScale(initial=True)
-        self.file_list_widget.setCurrentRow(self.file_id)
+        self.select_file(self.file_id)
+        self.prefetch()
+
+    def prefetch(self):
+        # decode the next and previous PREFETCH files, nearest first
+        paths = []
+        for k in range(1, PREFETCH + 1):
+            for i in (self.file_id + k, self.file_id - k):
+                path = self.file_dirs[i % len(self.file_dirs)]
+                if path != self.file_dirs[self.file_id] and path not in paths:
+                    paths.append(path)
+        self.canvas.image_cache.prefetch(paths)
 
     def load_labels(self, label_file):
-        self.label_list_widget.clear()
-        for label in self.labels:
-            item = QListWidgetItem(label)
-            self.label_list_widget.addItem(item)
-
-    def load_object_list(self, objects):
-        self.object_list_widget.clear()
-        for obj in objects:
-            item = QListWidgetItem(obj.label)
-            self.object_list_widget.addItem(item)
+        # read once, the index is shared by the label dock and the label dialog
+        with open(label_file, 'r') as f:
+            self.labels = f.read().splitlines()
+        self.label_index = LabelIndex(self.labels)
+        self.label_list_model.set_index(self.label_index)
+
+    def select_object(self, row):
+        self.object_list_view.setCurrentIndex(self.object_list_model.index(row))
+
+    def list_dirs(self, dirs):
+        # one directory listing instead of a stat per image and label file
+        names = {}
+        for image_dir in dirs:
+            try:
+                names[image_dir] = set(os.listdir(image_dir or '.'))
+            except OSError:
+                names[image_dir] = set()
+        return names
 
     def load_file_list(self):
-        self.file_list_widget.clear()
-
-        for image_dir in self.file_dirs:
-            if not QFile.exists(image_dir):
-                continue
-            item = QListWidgetItem(image_dir)
-            item.setFlags(Qt.ItemIsEnabled | Qt.ItemIsSelectable)
-            label_dir = os.path.splitext(image_dir)[0] + '.json'
-            if QFile.exists(label_dir):
-                item.setCheckState(Qt.Checked)
-            else:
-                item.setCheckState(Qt.Unchecked)
-            self.file_list_widget.addItem(item)
+        listing = self.list_dirs({os.path.dirname(image_dir) for image_dir in self.file_dirs})
+        self.file_dirs = [image_dir for image_dir in self.file_dirs
+                          if os.path.basename(image_dir) in listing[os.path.dirname(image_dir)]]
+        if self.canvas.label_store is not None:
+            stored_labels = self.canvas.label_store.labelled()
+            labelled = [image_dir for image_dir in self.file_dirs if label_path(image_dir) in stored_labels]
+            self.file_list_model.set_files(self.file_dirs, labelled)
+            self.canvas.label_store.add_images(self.file_dirs)
+            return
+        labelled = [image_dir for image_dir in self.file_dirs
+                    if os.path.basename(label_path(image_dir)) in listing[os.path.dirname(image_dir)]]
+        self.file_list_model.set_files(self.file_dirs, labelled)
+        self.watch_dirs(listing)
+
+    def watch_dirs(self, listing):
+        if self.file_watcher.directories():
+            self.file_watcher.removePaths(self.file_watcher.directories())
+        self.watched = {image_dir or '.': image_dir for image_dir in listing}
+        self.label_names = {image_dir: {name for name in names if name.endswith('.json')}
+                            for image_dir, names in listing.items()}
+        self.changed_dirs = set()
+        self.file_watcher.addPaths(list(self.watched))
+
+    def set_labelled(self, label_dir, labelled=True):
+        self.file_list_model.set_labelled(label_dir, labelled)
+
+    def schedule_rescan(self, path):
+        # a save touches the directory several times, rescan once after
+        self.changed_dirs.add(self.watched.get(path, path))
+        self.rescan_timer.start()
+
+    def rescan_labels(self):
+        """
+            Pick up label files created or deleted outside the app. Only the
+            directories that changed are listed and only the label files
+            that came or went since the last listing are updated, so the
+            app's own saves (a .tmp file renamed over a label file that is
+            already marked) cost one listing and no updates.
+        """
+        changed, self.changed_dirs = self.changed_dirs, set()
+        for image_dir, names in self.list_dirs(changed).items():
+            names = {name for name in names if name.endswith('.json')}
+            for name in names ^ self.label_names.get(image_dir, set()):
+                self.set_labelled(os.path.join(image_dir, name), name in names)
+            self.label_names[image_dir] = names
 
     def scaleFitWindow(self):
         """Figure out the size of the pixmap to fit the main widget."""
@@ -226,6 +381,8 @@ class MainWindow(QMainWindow):
         return w / self.canvas.pixmap.width()
 
     def adjustScale(self, initial=False):
+        if self.canvas.pixmap is None or self.canvas.pixmap.isNull():
+            return
         value = self.scalers[self.FIT_WINDOW if initial else self.zoomMode]()
         self.canvas.rescale(value)
 
@@ -244,6 +401,12 @@ class MainWindow(QMainWindow):
         print(self.canvas_area.width(), self.canvas_area.height())
         self.adjustScale(initial=True)
     
+    def select_mode(self):
+        self.canvas.points = []
+        self.canvas.clear_preview()
+        self.canvas.mode = self.canvas.SELECT
+        self.canvas.update()
+
     def new_rectangle(self):
         self.canvas.points = []
         self.canvas.mode = self.canvas.RECTANGLE
@@ -254,4 +417,8 @@ class MainWindow(QMainWindow):
 
     def new_polygon(self):
         self.canvas.points = []
-        self.canvas.mode = self.canvas.POLYGON
\ No newline at end of file
+        self.canvas.mode = self.canvas.POLYGON
+
+    def new_auto_segment(self):
+        self.canvas.points = []
+        self.canvas.mode = self.canvas.AUTO_SEGMENT
\ No newline at end of file
@@ -0,0 +1,83 @@
+"""
+    Pre-annotate images with rectilinear_polygon, headless
+
+        - Take image files, directories and --list files of image paths
+        - Run the auto-polygon pipeline on every image in a process pool
+        - Write <image>.json in the same format as Canvas.auto_export_json
+
+    Images that already have a label file are skipped, so an interrupted run
+    can simply be started again.
+"""
+
+import argparse
+import datetime
+import os
+import sys
+import time
+from multiprocessing import Pool
+
+from label_files import label_path, list_images, write_json
+
+def export_json(objects):
+    """
+        objects is a list of (type, label, [(x, y), ...]), return the dict
+        Canvas.auto_export_json would save for them
+    """
+    data = {}
+    data['date'] = str(datetime.datetime.now())
+    data['objects'] = []
+    for obj_type, label, points in objects:
+        data['objects'].append({
+            'type': obj_type,
+            'label': label,
+            'points': [{'x': float(x), 'y': float(y)} for x, y in points],
+        })
+    return data
+
+# OpenCV and the pipeline are imported by the workers only
+
+def init_worker():
+    # one OpenCV thread per process, the pool already uses every core
+    import cv2
+    cv2.setNumThreads(1)
+
+def annotate(job):
+    import cv2
+    import rectilinear_polygon
+    image_path, label = job
+    img = cv2.imread(image_path)
+    if img is None:
+        return image_path, 'unreadable', 0
+    points = rectilinear_polygon.main(img)
+    if len(points) == 0:
+        return image_path, 'empty', 0
+    write_json(label_path(image_path), export_json([('polygon', label, points)]))
+    return image_path, 'done', len(points)
+
+def run(images, label, jobs=None, overwrite=False, out=sys.stdout):
+    todo = [path for path in images if overwrite or not os.path.exists(label_path(path))]
+    print('%d images, %d already labelled, %d to do' % (len(images), len(images) - len(todo), len(todo)),
+          file=out, flush=True)
+
+    counts = {'done': 0, 'empty': 0, 'unreadable': 0}
+    start = time.time()
+    with Pool(jobs, initializer=init_worker) as pool:
+        for i, (image_path, status, n_points) in enumerate(
+                pool.imap_unordered(annotate, [(path, label) for path in todo], chunksize=4)):
+            counts[status] += 1
+            rate = (i + 1) / max(time.time() - start, 1e-6)
+            print('[%d/%d %.1f img/s] %s: %s %d points' % (i + 1, len(todo), rate, image_path, status, n_points),
+                  file=out, flush=True)
+    return counts
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Pre-annotate images with auto-polygons')
+    parser.add_argument('paths', nargs='*', help='image files or directories')
+    parser.add_argument('--list', action='append', default=[], help='text file with one image path per line')
+    parser.add_argument('--label', default='paragraph', help='label of the generated polygons')
+    parser.add_argument('--jobs', type=int, default=None, help='worker processes (default: all cores)')
+    parser.add_argument('--overwrite', action='store_true', help='also redo images that already have labels')
+    args = parser.parse_args()
+
+    counts = run(list_images(args.paths, args.list), args.label, args.jobs, args.overwrite)
+    print('done: %(done)d, empty: %(empty)d, unreadable: %(unreadable)d' % counts)
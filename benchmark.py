@@ -0,0 +1,219 @@
+"""
+    Benchmarks of the auto-polygon pipeline and of label loading / saving
+
+        - Pipeline stages on synthetic pages (sizes x words per line) and on
+          the samples in data/
+        - Canvas.load_file (image decoded every run) and auto_export_json
+          round trips, headless, with 10 to 10k objects
+        - Results are JSON (min / median of several runs, the revision and
+          versions), --compare OLD.json reports slowdowns against an older
+          run and exits with 1 if any is over --threshold
+
+    python benchmark.py --out results.json [--quick] [--compare old.json]
+"""
+
+import argparse
+import glob
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent import futures
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+import cv2
+import numpy as np
+
+import rectilinear_polygon
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+PAGE_SIZES = [(1240, 1754), (2480, 3508), (4960, 7016)]
+WORDS_PER_LINE = [4, 12]
+OBJECT_COUNTS = [10, 100, 1000, 10000]
+
+def synthetic_page(width, height, words_per_line=12, columns=1, seed=0):
+    """
+        White page of black word blocks in lines and paragraphs, the number
+        of connected components grows with words_per_line and the page
+        size. Return the BGR image and the number of words.
+    """
+    rng = np.random.default_rng(seed)
+    img = np.full((height, width, 3), 255, np.uint8)
+    margin = width // 20
+    line_h = max(6, height // 120)
+    column_w = (width - 2 * margin) // columns
+    pitch = column_w / words_per_line
+    count = 0
+    for column in range(columns):
+        x0, y = margin + column * column_w, margin
+        while y + line_h < height - margin:
+            if rng.random() < 0.1:
+                # paragraph break
+                y += 2 * line_h
+                continue
+            for k in range(words_per_line - int(rng.integers(0, 3))):
+                x = int(x0 + k * pitch)
+                w = int(pitch * rng.uniform(0.5, 0.8))
+                img[y:y + line_h, x:x + w] = 0
+                count += 1
+            y += line_h + line_h // 2
+    return img, count
+
+def measure(fn, repeat, setup=None):
+    # setup runs before every run, outside the timing
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return {'min': min(times), 'median': float(np.median(times)), 'runs': repeat}
+
+def bench_pipeline(name, img, repeat, results):
+    bin_img = rectilinear_polygon.binarize(img)
+    boxes = rectilinear_polygon.bbox_words(bin_img)
+    contours = rectilinear_polygon.merge_words_2_line(bin_img, boxes)
+    stages = [
+        ('binarize', lambda: rectilinear_polygon.binarize(img)),
+        ('bbox_words', lambda: rectilinear_polygon.bbox_words(bin_img)),
+        ('merge_words_2_line', lambda: rectilinear_polygon.merge_words_2_line(bin_img, boxes)),
+        ('merge_lines_2_paragraph', lambda: rectilinear_polygon.merge_lines_2_paragraph(bin_img, contours)),
+        ('main', lambda: rectilinear_polygon.main(img)),
+    ]
+    for stage, fn in stages:
+        result = measure(fn, repeat)
+        result.update(name='%s/%s' % (stage, name), components=len(boxes), lines=len(contours))
+        results.append(result)
+        print('%-50s %9.2fms' % (result['name'], result['min'] * 1000), file=sys.stderr)
+
+def label_data(n, width, height, seed=0):
+    rng = np.random.default_rng(seed)
+    objects = []
+    for i in range(n):
+        x, y = rng.uniform(0, width - 60), rng.uniform(0, height - 30)
+        if i % 2:
+            points = [(x, y), (x + 50, y + 20)]
+        else:
+            points = [(x, y), (x + 40, y), (x + 40, y + 10), (x + 20, y + 10), (x + 20, y + 25), (x, y + 25)]
+        objects.append({'type': 'rectangle' if i % 2 else 'polygon', 'label': 'paragraph',
+                        'points': [{'x': float(px), 'y': float(py)} for px, py in points]})
+    return {'date': '', 'objects': objects}
+
+def bench_canvas(counts, repeat, results):
+    from qtpy.QtWidgets import QApplication
+    app = QApplication.instance() or QApplication([])
+    from app import MainWindow
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        image_dir = os.path.join(tmp_dir, 'page.png')
+        cv2.imwrite(image_dir, synthetic_page(2480, 3508)[0])
+        win = MainWindow(label_file=os.path.join(HERE, 'labels.txt'))
+        canvas = win.canvas
+
+        def wait_index():
+            # the hash and PageIndex of the last load run on a thread, not
+            # during the next timing
+            futures.wait([future for future in (canvas.image_hash_future, canvas.page_index_future)
+                          if future is not None])
+
+        def cold():
+            # every run decodes the image instead of taking it from the cache
+            wait_index()
+            canvas.image_cache.clear()
+
+        # OpenCV and the pipeline are imported on the first load, not timed
+        canvas.load_file(image_dir)
+        wait_index()
+        for n in counts:
+            with open(os.path.join(tmp_dir, 'page.json'), 'w') as json_file:
+                json.dump(label_data(n, 2480, 3508), json_file)
+
+            def save():
+                canvas.auto_export_json()
+                canvas.flush_labels()
+                canvas.label_writer.wait()
+
+            for stage, fn, setup in (('load_file', lambda: canvas.load_file(image_dir), cold),
+                                     ('auto_export_json', save, wait_index)):
+                result = measure(fn, repeat, setup)
+                result.update(name='canvas/%s/%d' % (stage, n), objects=len(canvas.objects))
+                results.append(result)
+                print('%-50s %9.2fms' % (result['name'], result['min'] * 1000), file=sys.stderr)
+            app.processEvents()
+        win.close()
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+def environment():
+    try:
+        revision = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=HERE, capture_output=True,
+                                  text=True).stdout.strip() or None
+    except OSError:
+        revision = None
+    return {'revision': revision, 'date': time.strftime('%Y-%m-%d %H:%M:%S'), 'python': platform.python_version(),
+            'numpy': np.__version__, 'opencv': cv2.__version__, 'platform': platform.platform(),
+            'cpus': os.cpu_count(), 'pipeline': rectilinear_polygon.params()}
+
+def compare(old, new, threshold):
+    """
+        Print the min time ratio of every benchmark in both runs, return
+        the names that got slower than threshold
+    """
+    old_times = {result['name']: result['min'] for result in old['results']}
+    slower = []
+    for result in new['results']:
+        if result['name'] not in old_times:
+            continue
+        ratio = result['min'] / max(old_times[result['name']], 1e-9)
+        flag = ''
+        if ratio > threshold:
+            slower.append(result['name'])
+            flag = '  SLOWER'
+        print('%-50s %9.2fms -> %9.2fms  x%.2f%s' % (
+            result['name'], old_times[result['name']] * 1000, result['min'] * 1000, ratio, flag))
+    return slower
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the auto-polygon pipeline and label I/O')
+    parser.add_argument('--out', help='write the results to this JSON file (default: stdout)')
+    parser.add_argument('--quick', action='store_true', help='smallest page size and object counts only')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per benchmark, the min is compared')
+    parser.add_argument('--no-canvas', action='store_true', help='skip the Canvas benchmarks')
+    parser.add_argument('--compare', help='earlier results to compare against')
+    parser.add_argument('--threshold', type=float, default=1.2, help='slowdown ratio reported as a regression')
+    args = parser.parse_args()
+
+    sizes = PAGE_SIZES[:1] if args.quick else PAGE_SIZES
+    counts = OBJECT_COUNTS[:2] if args.quick else OBJECT_COUNTS
+
+    results = []
+    for width, height in sizes:
+        for words in WORDS_PER_LINE:
+            img, _ = synthetic_page(width, height, words)
+            bench_pipeline('synthetic_%dx%d_w%d' % (width, height, words), img, args.repeat, results)
+    for img_path in sorted(glob.glob(os.path.join(HERE, 'data', 'segment_*.*'))):
+        img = cv2.imread(img_path)
+        if img is not None:
+            bench_pipeline(os.path.basename(img_path), img, args.repeat, results)
+    if not args.no_canvas:
+        bench_canvas(counts, args.repeat, results)
+
+    report = {'environment': environment(), 'results': results}
+    if args.out:
+        with open(args.out, 'w') as out_file:
+            json.dump(report, out_file, indent=1)
+    else:
+        json.dump(report, sys.stdout, indent=1)
+
+    if args.compare:
+        with open(args.compare) as old_file:
+            slower = compare(json.load(old_file), report, args.threshold)
+        sys.exit(1 if slower else 0)
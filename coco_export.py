@@ -0,0 +1,163 @@
+"""
+    Export a labelled dataset as COCO instances JSON, optionally with masks
+
+        - Categories are the lines of labels.txt, ids from 1 in that order;
+          objects with other labels are skipped and counted
+        - Label files (or a label store) are read in a process pool, a window
+          of images at a time, and the JSON is written as it goes: images
+          straight to the output, annotations to a spool file appended at
+          the end, so memory does not grow with the dataset
+        - --masks DIR writes a PNG per image with the category id of every
+          pixel (0 is background), at the image's path relative to --root;
+          16-bit when there are more than 255 categories
+"""
+
+from label_files import label_path, list_images
+from label_store import LabelStore
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from multiprocessing import Pool
+
+import cv2
+import numpy as np
+from qtpy.QtGui import QImageReader
+
+# images handed to the pool at once, bounds the results waiting to be written
+WINDOW = 4096
+
+# per worker process
+store = None
+
+def init_export(store_path):
+    global store
+    # one OpenCV thread per process, the pool already uses every core
+    cv2.setNumThreads(1)
+    if store_path is not None:
+        store = LabelStore(store_path)
+
+def read_labels(image_path):
+    if store is not None:
+        return store.get(label_path(image_path))
+    try:
+        with open(label_path(image_path)) as json_file:
+            return json.load(json_file)
+    except (OSError, ValueError):
+        return None
+
+def polygon_area(coords):
+    x, y = coords[:, 0], coords[:, 1]
+    return 0.5 * abs(np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1)))
+
+def convert(job):
+    """
+        (image entry, annotations, skipped objects) of one image, None if
+        it has no label file or cannot be read
+    """
+    image_path, file_name, categories, mask_dir = job
+    data = read_labels(image_path)
+    if data is None:
+        return None
+    # the header is enough for the size, no need to decode
+    size = QImageReader(image_path).size()
+    if not size.isValid():
+        return None
+    width, height = size.width(), size.height()
+
+    annotations, skipped = [], 0
+    # 16-bit PNGs once the ids do not fit in 8 bits
+    mask_type = np.uint8 if len(categories) <= 255 else np.uint16
+    mask = np.zeros((height, width), mask_type) if mask_dir is not None else None
+    for obj in data['objects']:
+        category = categories.get(obj['label'])
+        coords = np.array([(point['x'], point['y']) for point in obj['points']], np.float64).reshape(-1, 2)
+        if category is None or len(coords) < 2:
+            skipped += 1
+            continue
+        if obj['type'] == 'rectangle':
+            (x1, y1), (x2, y2) = coords.min(axis=0), coords.max(axis=0)
+            coords = np.array([(x1, y1), (x2, y1), (x2, y2), (x1, y2)])
+        x1, y1 = coords.min(axis=0)
+        x2, y2 = coords.max(axis=0)
+        annotations.append({
+            'category_id': category,
+            'segmentation': [coords.ravel().round(2).tolist()],
+            'area': round(float(polygon_area(coords)), 2),
+            'bbox': [round(float(x1), 2), round(float(y1), 2), round(float(x2 - x1), 2), round(float(y2 - y1), 2)],
+            'iscrowd': 0,
+        })
+        if mask is not None:
+            cv2.fillPoly(mask, [coords.round().astype(np.int32)], category)
+
+    if mask is not None:
+        mask_path = os.path.join(mask_dir, os.path.splitext(file_name)[0] + '.png')
+        os.makedirs(os.path.dirname(mask_path), exist_ok=True)
+        cv2.imwrite(mask_path, mask)
+    image = {'file_name': file_name.replace(os.sep, '/'), 'width': width, 'height': height}
+    return image, annotations, skipped
+
+def export(images, categories, out_path, root='.', mask_dir=None, store_path=None, jobs=None, out=sys.stdout):
+    """
+        Write the COCO JSON of images to out_path, categories is the list of
+        label names. Return the counts of images, annotations and skipped
+        objects.
+    """
+    category_ids = {name: i + 1 for i, name in enumerate(categories)}
+    counts = {'images': 0, 'annotations': 0, 'skipped': 0}
+    start = time.time()
+    out_dir = os.path.dirname(os.path.abspath(out_path))
+    with open(out_path, 'w') as coco, tempfile.TemporaryFile('w+', dir=out_dir) as spool, \
+            Pool(jobs, initializer=init_export, initargs=(store_path,)) as pool:
+        coco.write('{"info": %s, "categories": %s, "images": [' % (
+            json.dumps({'description': 'clabel export', 'date_created': time.strftime('%Y-%m-%d %H:%M:%S')}),
+            json.dumps([{'id': i, 'name': name, 'supercategory': ''} for name, i in category_ids.items()])))
+        for w in range(0, len(images), WINDOW):
+            window = [(path, os.path.relpath(path, root), category_ids, mask_dir) for path in images[w:w + WINDOW]]
+            for result in pool.imap(convert, window, chunksize=16):
+                if result is None:
+                    continue
+                image, annotations, skipped = result
+                counts['images'] += 1
+                image['id'] = counts['images']
+                coco.write((',' if counts['images'] > 1 else '') + json.dumps(image))
+                for annotation in annotations:
+                    counts['annotations'] += 1
+                    annotation['id'] = counts['annotations']
+                    annotation['image_id'] = image['id']
+                    spool.write((',' if counts['annotations'] > 1 else '') + json.dumps(annotation))
+                counts['skipped'] += skipped
+            rate = min(w + WINDOW, len(images)) / max(time.time() - start, 1e-6)
+            print('[%d/%d %.1f img/s] %d images, %d annotations' % (
+                min(w + WINDOW, len(images)), len(images), rate, counts['images'], counts['annotations']),
+                file=out, flush=True)
+        coco.write('], "annotations": [')
+        spool.seek(0)
+        while True:
+            block = spool.read(1 << 20)
+            if not block:
+                break
+            coco.write(block)
+        coco.write(']}\n')
+    return counts
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export labels as COCO instances JSON')
+    parser.add_argument('paths', nargs='*', help='image files or directories')
+    parser.add_argument('--list', action='append', default=[], help='text file with one image path per line')
+    parser.add_argument('--labels', default='labels.txt', help='categories, one per line')
+    parser.add_argument('--out', default='coco.json', help='output JSON file')
+    parser.add_argument('--root', default='.', help='file names are relative to this directory')
+    parser.add_argument('--masks', help='also write category masks into this directory')
+    parser.add_argument('--store', help='read labels from this label store instead of JSON files')
+    parser.add_argument('--jobs', type=int, default=None, help='worker processes (default: all cores)')
+    args = parser.parse_args()
+
+    with open(args.labels) as f:
+        categories = [line for line in f.read().splitlines() if line.strip()]
+    counts = export(list_images(args.paths, args.list), categories, args.out, args.root,
+                    args.masks, args.store, args.jobs)
+    print('images: %(images)d, annotations: %(annotations)d, skipped objects: %(skipped)d' % counts)
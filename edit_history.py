@@ -0,0 +1,94 @@
+"""
+    Undo / redo history of the edits of every page opened in a session
+
+        - Edits are recorded as commands holding only what they change,
+          not copies of the object list:
+            ('add', [[row, obj], ...])      objects inserted at rows
+            ('delete', [[row, obj], ...])   objects removed from rows
+            ('relabel', row, old, new)      label of one object
+            ('move', row, old, new)         points of one object before
+                                            and after a drag
+        - Each page (label file) has its own undo and redo stack, kept
+          when other pages are opened
+        - undo / redo move one command between the stacks, O(1)
+        - The oldest commands of the least recently edited pages are
+          dropped once max_bytes is exceeded; sizes are estimated when a
+          command is recorded
+"""
+
+import os
+from collections import OrderedDict, deque
+
+# in MB
+UNDO_SIZE = float(os.environ.get('CLABEL_UNDO_SIZE', 64))
+
+# rough memory of a command and of an object besides their points
+COMMAND_BYTES = 200
+OBJECT_BYTES = 150
+
+def command_size(command):
+    kind = command[0]
+    if kind in ('add', 'delete'):
+        return COMMAND_BYTES + sum(OBJECT_BYTES + obj.coords.nbytes + len(obj.label or '')
+                                   for _, obj in command[1])
+    if kind == 'move':
+        return COMMAND_BYTES + command[2].nbytes + command[3].nbytes
+    return COMMAND_BYTES + len(command[2] or '') + len(command[3] or '')
+
+class EditHistory:
+    def __init__(self, max_bytes=UNDO_SIZE * 1024 * 1024):
+        self.max_bytes = max_bytes
+        # page -> (undo stack, redo stack) of (size, command), least
+        # recently used first
+        self.pages = OrderedDict()
+        self.nbytes = 0
+
+    def stacks(self, page):
+        if page not in self.pages:
+            self.pages[page] = (deque(), deque())
+        self.pages.move_to_end(page)
+        return self.pages[page]
+
+    def push(self, page, command):
+        # a new edit drops the edits that were undone
+        undo, redo = self.stacks(page)
+        while redo:
+            self.nbytes -= redo.pop()[0]
+        size = command_size(command)
+        undo.append((size, command))
+        self.nbytes += size
+        self.shrink()
+
+    def undo(self, page):
+        """
+            The last command of page, moved to its redo stack, None if
+            there is nothing to undo
+        """
+        undo, redo = self.stacks(page)
+        if not undo:
+            return None
+        redo.append(undo.pop())
+        return redo[-1][1]
+
+    def redo(self, page):
+        undo, redo = self.stacks(page)
+        if not redo:
+            return None
+        undo.append(redo.pop())
+        return undo[-1][1]
+
+    def clear(self, page):
+        undo, redo = self.pages.pop(page, ((), ()))
+        self.nbytes -= sum(size for size, _ in undo) + sum(size for size, _ in redo)
+
+    def shrink(self):
+        while self.nbytes > self.max_bytes and self.pages:
+            page, (undo, redo) = next(iter(self.pages.items()))
+            if undo:
+                # oldest edit first
+                self.nbytes -= undo.popleft()[0]
+            elif redo:
+                # the undone edit furthest from the current state first
+                self.nbytes -= redo.popleft()[0]
+            else:
+                del self.pages[page]
@@ -0,0 +1,85 @@
+"""
+    Memory-bounded cache of decoded images
+
+        - get(path) returns the decoded image, from the cache, from a
+          prefetch already running, or decoded right away
+        - prefetch(paths) decodes images on background threads ahead of use
+        - Least recently used images are dropped once max_bytes is exceeded
+"""
+
+import os
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# in MB
+IMAGE_CACHE_SIZE = float(os.environ.get('CLABEL_IMAGE_CACHE_SIZE', 1024))
+# number of next and previous files to decode ahead
+PREFETCH = int(os.environ.get('CLABEL_PREFETCH', 2))
+
+class ImageCache:
+    def __init__(self, load, size, max_bytes=IMAGE_CACHE_SIZE * 1024 * 1024, workers=2):
+        """
+            load(path) decodes an image, size(image) returns its memory in
+            bytes. Only call get / prefetch from one thread.
+        """
+        self.load = load
+        self.size = size
+        self.max_bytes = max_bytes
+        self.images = OrderedDict()
+        self.nbytes = 0
+        self.pending = {}
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+
+    def key(self, path):
+        # a file changed on disk must not be served from the cache
+        try:
+            return path, os.path.getmtime(path)
+        except OSError:
+            return path, None
+
+    def get(self, path):
+        key = self.key(path)
+        if key in self.images:
+            self.images.move_to_end(key)
+            return self.images[key]
+
+        future = self.pending.pop(key, None)
+        image = future.result() if future is not None else self.load(path)
+        self.add(key, image)
+        return image
+
+    def prefetch(self, paths):
+        """
+            Decode paths in the background, in order. Prefetches of files
+            that are not wanted any more are cancelled if they have not
+            started yet.
+        """
+        keys = [self.key(path) for path in paths]
+        for key in list(self.pending):
+            if key not in keys and self.pending[key].cancel():
+                del self.pending[key]
+        for key, future in list(self.pending.items()):
+            if future.done():
+                del self.pending[key]
+                if future.exception() is None:
+                    self.add(key, future.result())
+        for key in keys:
+            if key not in self.images and key not in self.pending:
+                self.pending[key] = self.pool.submit(self.load, key[0])
+
+    def add(self, key, image):
+        if image is None or key in self.images:
+            return
+        self.images[key] = image
+        self.nbytes += self.size(image)
+        # keep at least the image just added
+        while self.nbytes > self.max_bytes and len(self.images) > 1:
+            _, old_image = self.images.popitem(last=False)
+            self.nbytes -= self.size(old_image)
+
+    def clear(self):
+        for future in self.pending.values():
+            future.cancel()
+        self.pending = {}
+        self.images = OrderedDict()
+        self.nbytes = 0
@@ -0,0 +1,155 @@
+"""
+    Tiled image pyramid for very large scans
+
+        - Level k is the image downscaled by 2^k, cut into TILE x TILE tiles
+        - Tiles are made on first use, each from the four tiles below it,
+          so zooming out to a level reads the level under it only once
+        - Levels are memory-mapped files in TILE_DIR, reused the next time
+          the same image is opened; least recently used pyramids are
+          deleted once the directory grows over TILE_CACHE_SIZE
+        - Level 0 is the decoded image itself, it is never copied
+"""
+
+import hashlib
+import os
+import shutil
+import threading
+
+import numpy as np
+
+from polygon_cache import CACHE_DIR
+
+TILE = 512
+TILE_DIR = os.path.join(CACHE_DIR, 'tiles')
+# in MB
+TILE_CACHE_SIZE = float(os.environ.get('CLABEL_TILE_CACHE_SIZE', 2048))
+# smaller images are drawn whole, a pyramid would only cost disk space
+PYRAMID_MIN_PIXELS = int(os.environ.get('CLABEL_PYRAMID_MIN_PIXELS', 6000 * 6000))
+
+def pyramid_key(path, img):
+    # the same file, unchanged, gets the same pyramid
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        mtime = None
+    return hashlib.sha1(str((os.path.abspath(path), mtime, img.shape)).encode()).hexdigest()
+
+def disk_usage(path):
+    size = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                # level files are sparse until their tiles are made
+                size += os.stat(os.path.join(root, name)).st_blocks * 512
+            except OSError:
+                pass
+    return size
+
+def prune(tile_dir=TILE_DIR, max_size=TILE_CACHE_SIZE, keep=None):
+    """
+        Delete the least recently opened pyramids in tile_dir until it is
+        under max_size MB, never the one named keep
+    """
+    try:
+        entries = [entry for entry in os.scandir(tile_dir) if entry.is_dir() and entry.name != keep]
+    except OSError:
+        return
+    sizes = {entry.path: disk_usage(entry.path) for entry in entries}
+    total = sum(sizes.values()) + (disk_usage(os.path.join(tile_dir, keep)) if keep else 0)
+    for entry in sorted(entries, key=lambda entry: entry.stat().st_mtime):
+        if total <= max_size * 1024 * 1024:
+            break
+        shutil.rmtree(entry.path, ignore_errors=True)
+        total -= sizes[entry.path]
+
+class ImagePyramid:
+    def __init__(self, img, key, tile_dir=TILE_DIR):
+        """
+            img is the full resolution image (level 0), key names its
+            pyramid in tile_dir (see pyramid_key)
+        """
+        self.img = img
+        self.dir = os.path.join(tile_dir, key)
+        os.makedirs(self.dir, exist_ok=True)
+        # mark as recently used for prune
+        os.utime(self.dir)
+        h, w = img.shape[:2]
+        self.sizes = [(h, w)]
+        while max(h, w) > TILE:
+            h, w = (h + 1) // 2, (w + 1) // 2
+            self.sizes.append((h, w))
+        self.levels = [img] + [None] * (len(self.sizes) - 1)
+        # done[k][ty, tx] is 1 once the tile is written
+        self.done = [None] * len(self.sizes)
+        self.lock = threading.Lock()
+        self.open_lock = threading.Lock()
+
+    def level_for(self, scale):
+        # coarsest level that still has at least one pixel per screen pixel
+        level = 0
+        while level + 1 < len(self.sizes) and scale * 2 ** (level + 1) <= 1:
+            level += 1
+        return level
+
+    def open_level(self, level):
+        with self.open_lock:
+            if self.levels[level] is None:
+                self.create_level(level)
+        return self.levels[level]
+
+    def create_level(self, level):
+        h, w = self.sizes[level]
+        path = os.path.join(self.dir, '%d' % level)
+        grid = ((h + TILE - 1) // TILE, (w + TILE - 1) // TILE)
+        mode = 'r+' if os.path.exists(path + '.npy') and os.path.exists(path + '.done.npy') else 'w+'
+        try:
+            self.done[level] = np.lib.format.open_memmap(path + '.done.npy', mode, np.uint8, grid)
+            self.levels[level] = np.lib.format.open_memmap(path + '.npy', mode, self.img.dtype, (h, w) + self.img.shape[2:])
+        except (OSError, ValueError):
+            # unreadable leftovers, start the level again
+            self.done[level] = np.lib.format.open_memmap(path + '.done.npy', 'w+', np.uint8, grid)
+            self.levels[level] = np.lib.format.open_memmap(path + '.npy', 'w+', self.img.dtype, (h, w) + self.img.shape[2:])
+
+    def tiles(self, level, x1, y1, x2, y2):
+        """
+            (tx, ty) of the tiles of level covering the full resolution
+            rectangle x1, y1, x2, y2
+        """
+        size = TILE * 2 ** level
+        h, w = self.sizes[0]
+        x1, y1 = max(0, int(x1)) // size, max(0, int(y1)) // size
+        x2, y2 = (min(w, int(x2)) - 1) // size, (min(h, int(y2)) - 1) // size
+        return [(tx, ty) for ty in range(y1, y2 + 1) for tx in range(x1, x2 + 1)]
+
+    def tile_rect(self, level, tx, ty):
+        # x, y, w, h of the tile in level pixels
+        h, w = self.sizes[level]
+        x, y = tx * TILE, ty * TILE
+        return x, y, min(TILE, w - x), min(TILE, h - y)
+
+    def ready(self, level, tx, ty):
+        if level == 0:
+            return True
+        self.open_level(level)
+        return self.done[level][ty, tx] == 1
+
+    def tile(self, level, tx, ty):
+        """
+            The tile as an array view, made first if needed. Thread safe.
+        """
+        x, y, w, h = self.tile_rect(level, tx, ty)
+        if level > 0 and not self.ready(level, tx, ty):
+            below = self.tile_rect(level - 1, 2 * tx, 2 * ty)
+            # the (up to) four tiles below cover exactly this tile
+            for sy in (2 * ty, 2 * ty + 1):
+                for sx in (2 * tx, 2 * tx + 1):
+                    if sy * TILE < self.sizes[level - 1][0] and sx * TILE < self.sizes[level - 1][1]:
+                        self.tile(level - 1, sx, sy)
+            import cv2
+            with self.lock:
+                if self.done[level][ty, tx] == 0:
+                    lower = self.levels[level - 1]
+                    src = lower[below[1]:below[1] + 2 * TILE, below[0]:below[0] + 2 * TILE]
+                    self.levels[level][y:y + h, x:x + w] = cv2.resize(src, (w, h), interpolation=cv2.INTER_AREA)
+                    self.done[level][ty, tx] = 1
+        return self.levels[level][y:y + h, x:x + w]
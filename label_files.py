@@ -0,0 +1,41 @@
+"""
+    Label files next to the images, shared by the app, batch.py,
+    label_store.py and coco_export.py
+
+        - <image>.json holds the labels of <image>.<ext>
+        - Files are written to <file>.tmp and renamed into place, so a crash
+          or a killed run never leaves half a label file behind
+"""
+
+import json
+import os
+
+IMAGE_EXTS = ('.bmp', '.jpeg', '.jpg', '.png', '.tif', '.tiff', '.webp')
+
+def label_path(image_path):
+    return os.path.splitext(image_path)[0] + '.json'
+
+def list_images(paths, list_files=()):
+    """
+        Image paths from files, directories (not recursive) and list files
+        of one path per line
+    """
+    images = []
+    for list_file in list_files:
+        with open(list_file) as f:
+            images += [line for line in f.read().splitlines() if line.strip()]
+    for path in paths:
+        if os.path.isdir(path):
+            images += sorted(os.path.join(path, name) for name in os.listdir(path)
+                             if name.lower().endswith(IMAGE_EXTS))
+        else:
+            images.append(path)
+    return images
+
+def write_json(path, data):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as json_file:
+        json.dump(data, json_file)
+        json_file.flush()
+        os.fsync(json_file.fileno())
+    os.replace(tmp_path, path)
@@ -0,0 +1,103 @@
+"""
+    Search index over the label names, for taxonomies of thousands of labels
+
+        - Labels are lowercased and joined into one array of character
+          codes, with the offset of every label, the positions of every
+          character (found on first use) and a mask of the positions that start a word or
+          a level of the hierarchy. A query is a few NumPy operations over
+          all labels at once instead of a Python loop over them:
+          substrings narrow the positions of their first character, fuzzy
+          matches step every label to the next position of each character
+        - Matches are ranked exact, prefix, prefix of a word or level
+          ('table' in 'layout/table'), substring, then fuzzy (the letters
+          of the query in order); recently used labels first within each
+          rank, then the order of the label file
+        - use(label) moves a label to the front of the recently used list
+"""
+
+import numpy as np
+
+# characters after which a word or a level of the hierarchy starts
+SEPARATORS = '/ _-.:>'
+
+MAX_RECENT = 20
+
+EXACT, PREFIX, WORD, SUBSTRING, FUZZY, NONE = range(6)
+
+class LabelIndex:
+    def __init__(self, labels):
+        self.labels = list(labels)
+        lower = [label.lower().replace('\n', ' ') for label in self.labels]
+        self.codes = np.frombuffer('\n'.join(lower).encode('utf-32-le'), np.uint32)
+        self.lengths = np.array([len(label) for label in lower], np.int64)
+        self.starts = np.cumsum(self.lengths + 1) - self.lengths - 1
+        self.ends = self.starts + self.lengths
+        after = np.isin(self.codes, [ord(c) for c in SEPARATORS + '\n'])
+        self.word_start = np.concatenate(([True], after[:-1]))
+        # character -> its positions, ascending, filled in as queries use them
+        self.positions = {}
+        # first row of every label, rows of recently used labels
+        self.rows = {}
+        for row, label in enumerate(self.labels):
+            self.rows.setdefault(label, row)
+        self.recent = []
+
+    def __len__(self):
+        return len(self.labels)
+
+    def char_positions(self, c):
+        if c not in self.positions:
+            self.positions[c] = np.flatnonzero(self.codes == ord(c))
+        return self.positions[c]
+
+    def substring(self, query):
+        # positions of every occurrence of query, overlapping ones too
+        hits = self.char_positions(query[0])
+        hits = hits[hits + len(query) <= len(self.codes)]
+        for j in range(1, len(query)):
+            hits = hits[self.codes[hits + j] == ord(query[j])]
+        return hits
+
+    def fuzzy(self, query):
+        # rows of the labels that have the characters of query in order
+        rows = np.arange(len(self.labels))
+        pos = self.starts - 1
+        for c in query:
+            chars = self.char_positions(c)
+            # next position of c after the last matched character
+            k = np.searchsorted(chars, pos + 1)
+            found = k < len(chars)
+            rows, pos = rows[found], chars[k[found]]
+            found = pos < self.ends[rows]
+            rows, pos = rows[found], pos[found]
+        return rows
+
+    def search(self, query):
+        """
+            Rows of the labels matching query, best first. An empty query
+            matches every label.
+        """
+        query = query.strip().lower()
+        rank = np.full(len(self.labels), NONE if query else EXACT, np.int8)
+        if query and len(self.labels) > 0:
+            rank[self.fuzzy(query)] = FUZZY
+            hits = self.substring(query)
+            rows = np.searchsorted(self.starts, hits, 'right') - 1
+            hit_rank = np.where(self.word_start[hits], WORD, SUBSTRING).astype(np.int8)
+            prefix = hits == self.starts[rows]
+            hit_rank[prefix] = PREFIX
+            hit_rank[prefix & (self.lengths[rows] == len(query))] = EXACT
+            np.minimum.at(rank, rows, hit_rank)
+        matched = np.flatnonzero(rank < NONE)
+        recency = np.full(len(self.labels), MAX_RECENT, np.int64)
+        recency[self.recent] = np.arange(len(self.recent))
+        return matched[np.lexsort((matched, recency[matched], rank[matched]))]
+
+    def use(self, label):
+        row = self.rows.get(label)
+        if row is None:
+            return
+        if row in self.recent:
+            self.recent.remove(row)
+        self.recent.insert(0, row)
+        del self.recent[MAX_RECENT:]
@@ -0,0 +1,190 @@
+"""
+    Single-file store of the labels of a whole dataset
+
+        - One SQLite file with a row per label file and a row per object,
+          objects indexed by label, so dataset-wide queries do not open a
+          file per image
+        - Label files are keyed by their path relative to the store, the
+          same <image>.json paths the app uses without a store; images are
+          registered too, to find the ones without labels
+        - import / export convert from and to the per-image JSON layout
+        - Set CLABEL_STORE to a store file to make the app read and write
+          labels there instead of next to the images
+
+    python label_store.py STORE import DIR...   register images, read their JSON
+    python label_store.py STORE export [DIR...] write <image>.json files
+    python label_store.py STORE query --label table | --unlabelled
+"""
+
+from label_files import label_path, list_images, write_json
+
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+import numpy as np
+
+# path of the store the app uses, per-image JSON files if not set
+STORE = os.environ.get('CLABEL_STORE')
+
+def points_blob(points):
+    # label file points as float64 x, y pairs
+    return np.fromiter((value for point in points for value in (point['x'], point['y'])),
+                       np.float64, 2 * len(points)).tobytes()
+
+def blob_points(blob):
+    return [{'x': x, 'y': y} for x, y in np.frombuffer(blob, np.float64).reshape(-1, 2).tolist()]
+
+class LabelStore:
+    def __init__(self, path):
+        self.root = os.path.dirname(os.path.abspath(path))
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, timeout=5, check_same_thread=False)
+        with self.db:
+            self.db.execute('PRAGMA journal_mode=WAL')
+            # date is NULL for images without labels yet, image is NULL for
+            # labels saved before their image was registered
+            self.db.execute('CREATE TABLE IF NOT EXISTS pages '
+                            '(id INTEGER PRIMARY KEY, key TEXT UNIQUE, image TEXT, date TEXT)')
+            self.db.execute('CREATE TABLE IF NOT EXISTS objects '
+                            '(page INTEGER, idx INTEGER, type TEXT, label TEXT, points BLOB, '
+                            'PRIMARY KEY (page, idx)) WITHOUT ROWID')
+            self.db.execute('CREATE INDEX IF NOT EXISTS objects_label ON objects (label)')
+            self.db.execute('CREATE INDEX IF NOT EXISTS pages_date ON pages (date)')
+
+    def key(self, label_dir):
+        return os.path.relpath(os.path.abspath(label_dir), self.root).replace(os.sep, '/')
+
+    def path(self, key):
+        return os.path.join(self.root, key.replace('/', os.sep))
+
+    def get(self, label_dir):
+        """
+            The label file data of label_dir, None if it has no labels
+        """
+        with self.lock:
+            page = self.db.execute('SELECT id, date FROM pages WHERE key = ?', (self.key(label_dir),)).fetchone()
+            if page is None or page[1] is None:
+                return None
+            rows = self.db.execute('SELECT type, label, points FROM objects WHERE page = ? ORDER BY idx',
+                                   (page[0],)).fetchall()
+        return {'date': page[1], 'objects': [{'type': obj_type, 'label': label, 'points': blob_points(points)}
+                                             for obj_type, label, points in rows]}
+
+    def put(self, label_dir, data):
+        self.put_many([(label_dir, data)])
+
+    def put_many(self, items):
+        # (label_dir, data) pairs in one transaction
+        with self.lock, self.db:
+            for label_dir, data in items:
+                key = self.key(label_dir)
+                self.db.execute('INSERT INTO pages (key, date) VALUES (?, ?) '
+                                'ON CONFLICT (key) DO UPDATE SET date = excluded.date', (key, data['date']))
+                page = self.db.execute('SELECT id FROM pages WHERE key = ?', (key,)).fetchone()[0]
+                self.db.execute('DELETE FROM objects WHERE page = ?', (page,))
+                self.db.executemany('INSERT INTO objects VALUES (?, ?, ?, ?, ?)',
+                                    [(page, i, obj['type'], obj['label'], points_blob(obj['points']))
+                                     for i, obj in enumerate(data['objects'])])
+
+    def add_images(self, images):
+        # register images, the ones without labels are listed by unlabelled()
+        with self.lock, self.db:
+            self.db.executemany('INSERT INTO pages (key, image) VALUES (?, ?) '
+                                'ON CONFLICT (key) DO UPDATE SET image = excluded.image',
+                                [(self.key(label_path(image_dir)), self.key(image_dir)) for image_dir in images])
+
+    def labelled(self):
+        with self.lock:
+            rows = self.db.execute('SELECT key FROM pages WHERE date IS NOT NULL').fetchall()
+        return {self.path(key) for key, in rows}
+
+    def unlabelled(self):
+        # registered images without labels
+        with self.lock:
+            rows = self.db.execute('SELECT image FROM pages WHERE date IS NULL').fetchall()
+        return [self.path(image) for image, in rows]
+
+    def objects(self, label):
+        """
+            (label_dir, type, points) of every object with label, points
+            as an (n, 2) array
+        """
+        with self.lock:
+            rows = self.db.execute('SELECT pages.key, objects.type, objects.points FROM objects '
+                                   'JOIN pages ON pages.id = objects.page WHERE objects.label = ?',
+                                   (label,)).fetchall()
+        paths = {key: self.path(key) for key in {row[0] for row in rows}}
+        return [(paths[key], obj_type, np.frombuffer(points, np.float64).reshape(-1, 2))
+                for key, obj_type, points in rows]
+
+    def import_json(self, images, batch=1000):
+        """
+            Register images and copy the label files they have into the
+            store. Return the number of label files read.
+        """
+        self.add_images(images)
+        label_dirs = [label_path(image_dir) for image_dir in images]
+        count = 0
+        for i in range(0, len(label_dirs), batch):
+            items = []
+            for label_dir in label_dirs[i:i + batch]:
+                try:
+                    with open(label_dir) as json_file:
+                        items.append((label_dir, json.load(json_file)))
+                except (OSError, ValueError):
+                    continue
+            self.put_many(items)
+            count += len(items)
+        return count
+
+    def export_json(self, label_dirs=None):
+        """
+            Write the label files of the store (or of label_dirs only) next
+            to their images. Return the number written.
+        """
+        label_dirs = sorted(self.labelled()) if label_dirs is None else label_dirs
+        count = 0
+        for label_dir in label_dirs:
+            data = self.get(label_dir)
+            if data is not None:
+                write_json(label_dir, data)
+                count += 1
+        return count
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Single-file label store')
+    parser.add_argument('store', help='store file, created if missing')
+    parser.add_argument('command', choices=['import', 'export', 'query'])
+    parser.add_argument('paths', nargs='*', help='image files or directories (import / export)')
+    parser.add_argument('--list', action='append', default=[], help='text file with one image path per line')
+    parser.add_argument('--label', help='query: objects with this label')
+    parser.add_argument('--unlabelled', action='store_true', help='query: images without labels')
+    args = parser.parse_args()
+
+    store = LabelStore(args.store)
+    start = time.time()
+    if args.command == 'import':
+        images = list_images(args.paths, args.list)
+        count = store.import_json(images)
+        print('%d images, %d label files imported' % (len(images), count))
+    elif args.command == 'export':
+        label_dirs = None
+        if args.paths or args.list:
+            label_dirs = [label_path(image_dir) for image_dir in list_images(args.paths, args.list)]
+        print('%d label files written' % store.export_json(label_dirs))
+    elif args.unlabelled:
+        for image_dir in store.unlabelled():
+            print(image_dir)
+    elif args.label is not None:
+        objects = store.objects(args.label)
+        for label_dir, obj_type, points in objects:
+            print(label_dir, obj_type, len(points))
+        print('%d objects' % len(objects), file=sys.stderr)
+    else:
+        parser.error('query needs --label or --unlabelled')
+    print('%.1fms' % ((time.time() - start) * 1000), file=sys.stderr)
@@ -1,12 +1,30 @@
+import time
+START = time.perf_counter()
+
 from app import MainWindow
 
+import os
 import sys
 from qtpy.QtWidgets import QApplication
+from qtpy.QtCore import QTimer
+
+def report_startup(stages):
+    # CLABEL_TIMING=1: time from launch to each stage, to stderr
+    for stage, seconds in stages:
+        print('%-12s %8.1f ms' % (stage, (seconds - START) * 1000), file=sys.stderr)
 
 if __name__ == '__main__':
+    stages = [('imports', time.perf_counter())]
     app = QApplication([])
+    stages.append(('qapplication', time.perf_counter()))
 
     win = MainWindow(label_file=sys.argv[1])
+    stages.append(('window', time.perf_counter()))
     win.show()
+    stages.append(('shown', time.perf_counter()))
+
+    if os.environ.get('CLABEL_TIMING'):
+        # runs once the event loop has painted the window and handles input
+        QTimer.singleShot(0, lambda: report_startup(stages + [('interactive', time.perf_counter())]))
 
-    sys.exit(app.exec_())
\ No newline at end of file
+    sys.exit(app.exec_())
@@ -0,0 +1,129 @@
+"""
+    Disk-backed cache of auto-polygon results
+
+        - Keyed by image content hash, region and pipeline parameters, so it
+          can be shared by everyone working on the same dataset
+        - Stored in one SQLite file, capped in size, least recently used
+          entries are evicted first; the total size is kept up to date by
+          triggers in a meta row, so a put does not sum the whole table
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+CACHE_DIR = os.environ.get('CLABEL_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'clabel'))
+# in MB, 0 disables the cache
+CACHE_SIZE = float(os.environ.get('CLABEL_CACHE_SIZE', 256))
+
+# entries read per eviction query
+EVICT_BATCH = 100
+
+def image_hash(img):
+    h = hashlib.sha1(str((img.shape, img.dtype.str)).encode())
+    h.update(img.data if img.flags['C_CONTIGUOUS'] else img.tobytes())
+    return h.hexdigest()
+
+def to_json(polygons):
+    # points are (x, y) tuples of numpy ints, which JSON does not take
+    if isinstance(polygons, tuple):
+        return [int(polygons[0]), int(polygons[1])]
+    return [to_json(value) for value in polygons]
+
+def from_json(polygons):
+    if len(polygons) > 0 and isinstance(polygons[0], int):
+        return tuple(polygons)
+    return [from_json(value) for value in polygons]
+
+class PolygonCache:
+    def __init__(self, path=None, max_size=CACHE_SIZE):
+        self.max_size = int(max_size * 1024 * 1024)
+        self.lock = threading.Lock()
+        self.db = None
+        if self.max_size <= 0:
+            return
+        try:
+            self.open(path)
+        except (OSError, sqlite3.Error):
+            # no writable cache directory, run without the cache
+            if self.db is not None:
+                self.db.close()
+            self.db = None
+
+    def open(self, path):
+        if path is None:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            path = os.path.join(CACHE_DIR, 'polygons.sqlite')
+        self.db = sqlite3.connect(path, timeout=5, check_same_thread=False)
+        with self.db:
+            self.db.execute('CREATE TABLE IF NOT EXISTS polygons '
+                            '(key TEXT PRIMARY KEY, value TEXT, size INTEGER, last_used REAL)')
+            self.db.execute('CREATE INDEX IF NOT EXISTS polygons_last_used ON polygons (last_used)')
+            self.db.execute('CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER)')
+            # caches made before the meta row start from their current size
+            self.db.execute("INSERT OR IGNORE INTO meta SELECT 'size', COALESCE(SUM(size), 0) FROM polygons")
+            self.db.execute("CREATE TRIGGER IF NOT EXISTS polygons_insert AFTER INSERT ON polygons BEGIN "
+                            "UPDATE meta SET value = value + NEW.size WHERE name = 'size'; END")
+            self.db.execute("CREATE TRIGGER IF NOT EXISTS polygons_update AFTER UPDATE OF size ON polygons BEGIN "
+                            "UPDATE meta SET value = value - OLD.size + NEW.size WHERE name = 'size'; END")
+            self.db.execute("CREATE TRIGGER IF NOT EXISTS polygons_delete AFTER DELETE ON polygons BEGIN "
+                            "UPDATE meta SET value = value - OLD.size WHERE name = 'size'; END")
+
+    @staticmethod
+    def key(img_hash, kind, rect, params):
+        return hashlib.sha1(json.dumps([img_hash, kind, list(rect), params], sort_keys=True).encode()).hexdigest()
+
+    def get(self, key):
+        if self.db is None:
+            return None
+        with self.lock, self.db:
+            row = self.db.execute('SELECT value FROM polygons WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            self.db.execute('UPDATE polygons SET last_used = ? WHERE key = ?', (time.time(), key))
+        return from_json(json.loads(row[0]))
+
+    def put(self, key, polygons):
+        if self.db is None:
+            return
+        value = json.dumps(to_json(polygons))
+        with self.lock, self.db:
+            # an upsert, not INSERT OR REPLACE, whose implicit delete would
+            # not fire the delete trigger
+            self.db.execute('INSERT INTO polygons VALUES (?, ?, ?, ?) ON CONFLICT (key) DO UPDATE SET '
+                            'value = excluded.value, size = excluded.size, last_used = excluded.last_used',
+                            (key, value, len(key) + len(value), time.time()))
+            self.evict()
+
+    def size(self):
+        return self.db.execute("SELECT value FROM meta WHERE name = 'size'").fetchone()[0]
+
+    def evict(self):
+        total = self.size()
+        if total <= self.max_size:
+            return
+        # drop the least recently used entries down to 90% of the cap, a
+        # batch at a time
+        excess = total - int(0.9 * self.max_size)
+        while excess > 0:
+            rows = self.db.execute('SELECT key, size FROM polygons ORDER BY last_used LIMIT ?',
+                                   (EVICT_BATCH,)).fetchall()
+            if len(rows) == 0:
+                break
+            keys = []
+            for key, size in rows:
+                if excess <= 0:
+                    break
+                keys.append((key,))
+                excess -= size
+            self.db.executemany('DELETE FROM polygons WHERE key = ?', keys)
+
+    def cached(self, key, compute):
+        polygons = self.get(key)
+        if polygons is None:
+            polygons = compute()
+            self.put(key, polygons)
+        return polygons
@@ -3,7 +3,9 @@
 
         - Global binarize image
         - Find word (connected component RETR_BOUNDARY)
-        - Find Rectilinear Polygon
+        - Find Rectilinear Polygon: axis-aligned outline of the filled
+          region from the first and last pixel of every row, with at most
+          MAX_VERTICES vertices
     
     Return an list of points in order
 """
@@ -11,12 +13,67 @@
 import cv2
 import numpy as np
 import sys
-import matplotlib.pyplot as plt
+import os
+import glob
+import time
+import heapq
+import bisect
+import argparse
+from concurrent.futures import ThreadPoolExecutor
 
 PADDING = 2
+# regions smaller than this (in pixels) are dropped by segment
+MIN_REGION_AREA = 200
+# segment finds word boxes on tiles of this size, with an overlap margin
+TILE_SIZE = 2048
+TILE_MARGIN = 256
+
+# Debug images (crop.png, line.png, highlight.png) are only written when
+# CLABEL_DEBUG is set, on a background thread into CLABEL_DEBUG_DIR
+DEBUG = bool(os.environ.get('CLABEL_DEBUG'))
+DEBUG_DIR = os.environ.get('CLABEL_DEBUG_DIR', '.')
+_debug_writer = None
+
+def dump(name, img):
+    global _debug_writer
+    if not DEBUG:
+        return
+    if _debug_writer is None:
+        _debug_writer = ThreadPoolExecutor(max_workers=1)
+    _debug_writer.submit(cv2.imwrite, os.path.join(DEBUG_DIR, name), img.copy())
+
+def print_timing(stage, seconds):
+    print('%-10s %8.2f ms' % (stage, seconds * 1000), file=sys.stderr)
+
+# Called as TIMING(stage, seconds) after every stage of main, e.g. print_timing
+TIMING = print_timing if os.environ.get('CLABEL_TIMING') else None
+
+# 'global': one Otsu threshold per page, cached in a PageIndex (fast, the
+# default in the app); 'local': one Otsu threshold per dragged region
+THRESHOLD = os.environ.get('CLABEL_THRESHOLD', 'global')
+
+# outline steps of at most this many pixels are smoothed away, and rows are
+# merged further until a polygon has at most MAX_VERTICES vertices (0: no cap)
+OUTLINE_TOLERANCE = int(os.environ.get('CLABEL_OUTLINE_TOLERANCE', 4))
+MAX_VERTICES = int(os.environ.get('CLABEL_MAX_VERTICES', 64))
+
+# bump when a change makes cached results out of date
+PIPELINE_VERSION = 2
+
+def params():
+    # everything that changes the output for the same image and region
+    return {'version': PIPELINE_VERSION, 'threshold': THRESHOLD, 'padding': PADDING, 'min_area': MIN_REGION_AREA,
+            'tolerance': OUTLINE_TOLERANCE, 'max_vertices': MAX_VERTICES}
+
+def lap(timing, stage, start):
+    now = time.perf_counter()
+    if timing is not None:
+        timing(stage, now - start)
+    return now
 
 def binarize(img):
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    # the app hands over BGRA images, files read with cv2.imread are BGR
+    gray = cv2.cvtColor(img, cv2.COLOR_BGRA2GRAY if img.shape[2] == 4 else cv2.COLOR_BGR2GRAY)
     _, bin_img = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
     return bin_img
 
@@ -37,10 +94,160 @@ def draw_region(img, x1, y1, x2, y2):
     y2 = min(y2, h)
     cv2.rectangle(img, (x1, y1), (x2, y2), 255, -1)
 
+def reaches(upper, lower):
+    # upper/lower are (x1, y1, x2, y2) with upper[1] <= lower[1]
+    return 2 * (upper[3] - lower[1]) >= 0.5 * (upper[3] - upper[1] + lower[3] - lower[1])
+
+def same_line(a, b):
+    # either box may be the upper one when their tops are equal
+    if a[1] > b[1]:
+        a, b = b, a
+    return reaches(a, b) or (a[1] == b[1] and reaches(b, a))
+
+def union(a, b):
+    return [min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])]
+
+def group_lines(boxes):
+    """
+        The all-pairs merge of merge_words_2_line_legacy on the (x, y, w, h)
+        word boxes sorted by top then left, with the same result, but each
+        box only meets the boxes whose top lies within its height.
+
+        Like the legacy loop, every box in turn is the upper one and meets
+        the others in order; when it reaches one, both become their union.
+        Boxes with the same rect are kept together, by their top (a box only
+        ever moves up, to the top of the box that reached it), and those
+        equal to the upper box are passed over at once since meeting them
+        changes nothing.
+
+        Return an array of the distinct (x, y, w, h) line boxes
+    """
+    boxes = np.asarray(boxes, dtype=np.int64).reshape(-1, 4)
+    if len(boxes) == 0:
+        return boxes
+
+    # fully sorted, so the result does not depend on the input order
+    boxes = boxes[np.lexsort((boxes[:, 3], boxes[:, 2], boxes[:, 0], boxes[:, 1]))]
+    rects = [tuple(rect) for rect in np.concatenate([boxes[:, :2], boxes[:, :2] + boxes[:, 2:]], axis=1).tolist()]
+    # rect -> sorted indices of the boxes that have it, top -> those rects
+    members = {}
+    for j, rect in enumerate(rects):
+        members.setdefault(rect, []).append(j)
+    groups = {}
+    for rect in members:
+        groups.setdefault(rect[1], set()).add(rect)
+    # every top a box can have
+    tops = sorted(groups)
+
+    def move(j, rect):
+        old = members[rects[j]]
+        del old[bisect.bisect_left(old, j)]
+        if len(old) == 0:
+            del members[rects[j]]
+            groups[rects[j][1]].discard(rects[j])
+        bisect.insort(members.setdefault(rect, []), j)
+        groups[rect[1]].add(rect)
+        rects[j] = rect
+
+    def meet(candidates, k, first):
+        # the rects at the tops the upper box now covers, from index first on
+        while k < len(tops) and tops[k] <= rects[i][3]:
+            for rect in groups[tops[k]]:
+                heapq.heappush(candidates, (first, rect))
+            k += 1
+        return k
+
+    for i in range(len(rects)):
+        candidates = []
+        k = meet(candidates, bisect.bisect_left(tops, rects[i][1]), 0)
+        while candidates:
+            first, rect = heapq.heappop(candidates)
+            indices = members.get(rect, ())
+            pos = bisect.bisect_left(indices, first)
+            if pos == len(indices):
+                continue
+            j = indices[pos]
+            if j != first:
+                # boxes left the rect since it was queued
+                heapq.heappush(candidates, (j, rect))
+                continue
+            if rect == rects[i]:
+                # nothing changes until a box with another rect is met
+                nxt = candidates[0][0] if candidates else len(rects)
+                pos = bisect.bisect_left(indices, max(nxt, j + 1))
+                if pos < len(indices):
+                    heapq.heappush(candidates, (indices[pos], rect))
+                continue
+            heapq.heappush(candidates, (j + 1, rect))
+            if not reaches(rects[i], rect):
+                continue
+            merged = tuple(union(rects[i], rect))
+            move(i, merged)
+            move(j, merged)
+            k = meet(candidates, k, j + 1)
+
+    lines = np.array(list(members), dtype=np.int64)
+    lines[:, 2:] -= lines[:, :2]
+    return lines
+
+def draw_lines(bin_img, list_bboxes):
+    highlight_img = bin_img.copy()
+    for x, y, w, h in list_bboxes:
+        draw_region(highlight_img, x, y, x + w, y + h)
+    return highlight_img
+
+def group_column_lines(boxes, max_gap=1.0):
+    """
+        Like group_lines, but a word only joins a line when the horizontal
+        gap between them is at most max_gap times the word height, so lines
+        in different columns of a page stay apart.
+
+        Lines are retired once the sweep passes their bottom, so each word
+        only meets the few lines (about one per column) still open.
+    """
+    boxes = np.asarray(boxes, dtype=np.int64).reshape(-1, 4)
+    if len(boxes) == 0:
+        return boxes
+
+    # sort by top then left, so the result does not depend on the input order
+    boxes = boxes[np.lexsort((boxes[:, 0], boxes[:, 1]))]
+    corners = np.concatenate([boxes[:, :2], boxes[:, :2] + boxes[:, 2:]], axis=1)
+
+    lines, active = [], []
+    for box in corners.tolist():
+        still_open = []
+        for line in active:
+            if line[3] >= box[1]:
+                still_open.append(line)
+            else:
+                lines.append(line)
+        active = still_open
+        for line in active:
+            gap = max(line[0], box[0]) - min(line[2], box[2])
+            if gap <= max_gap * (box[3] - box[1]) and same_line(line, box):
+                line[0] = min(line[0], box[0])
+                line[2] = max(line[2], box[2])
+                line[3] = max(line[3], box[3])
+                break
+        else:
+            active.append(box)
+
+    lines = np.array(lines + active, dtype=np.int64)
+    lines[:, 2:] -= lines[:, :2]
+    return lines
+
 def merge_words_2_line(bin_img, list_bboxes):
-    list_bboxes.sort(key = lambda bbox: bbox[1])
+    highlight_img = draw_lines(bin_img, group_lines(list_bboxes).tolist())
 
-    cnt = len(list_bboxes)
+    dump('line.png', highlight_img)
+    contours = cv2.findContours(highlight_img, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[-2]
+    return contours
+
+def merge_words_2_line_legacy(bin_img, list_bboxes):
+    """
+        Original all-pairs merge, kept as the reference for --verify
+    """
+    list_bboxes = sorted(list_bboxes, key = lambda bbox: bbox[1])
 
     for i in range(len(list_bboxes)):
         for j in range(len(list_bboxes)):
@@ -52,61 +259,491 @@ def merge_words_2_line(bin_img, list_bboxes):
                 list_bboxes[i] = x_left, y_left, x_right - x_left, y_right - y_left
                 list_bboxes[j] = x_left, y_left, x_right - x_left, y_right - y_left
 
-    highlight_img = bin_img.copy()
-    for i in range(cnt):
-        x, y, w, h = list_bboxes[i]
-        draw_region(highlight_img, x, y, x + w, y + h)
-    
-    cv2.imwrite('line.png', highlight_img)
+    highlight_img = draw_lines(bin_img, list_bboxes)
     contours = cv2.findContours(highlight_img, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[-2]
     return contours
 
-def merge_lines_2_paragraph(bin_img, contours):
-    cnt = len(contours)
+def line_rects(contours):
+    return np.array([cv2.boundingRect(contour) for contour in contours], dtype=np.int64).reshape(-1, 4)
+
+def adjacent_line_pairs(rects):
+    """
+        Find every pair (i, j) of (x, y, w, h) line rects where line j starts
+        below line i, close enough to continue the same paragraph, and both
+        overlap horizontally.
+
+        Lines are sorted by top edge once, so each line only looks at the
+        window of lines starting within reach of its bottom instead of all
+        other lines. Return two index arrays (upper, lower)
+    """
+    if len(rects) == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+    x, y, w, h = rects.T
+    order = np.argsort(y, kind='stable')
+    sorted_y = y[order]
+    # a lower line may reach up by at most a quarter of the tallest line
+    reach = y + h + h // 4 + h.max() // 4
+    lo = np.searchsorted(sorted_y, y, side='right')
+    hi = np.searchsorted(sorted_y, reach, side='right')
+
+    upper, lower = [], []
+    for i in range(len(rects)):
+        if lo[i] == hi[i]:
+            continue
+        js = order[lo[i]:hi[i]]
+        keep = (y[i] + h[i] + h[i] // 4 >= y[js] - h[js] // 4) & \
+            (np.maximum(x[i], x[js]) < np.minimum(x[i] + w[i], x[js] + w[js]))
+        js = js[keep]
+        upper.append(np.full(len(js), i, dtype=np.int64))
+        lower.append(js)
+
+    if len(upper) == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    return np.concatenate(upper), np.concatenate(lower)
+
+def fill_paragraphs(bin_img, contours):
+    """
+        Fill the gaps between vertically adjacent, horizontally overlapping
+        line contours and return the contours of the resulting regions
+    """
     highlight_img = bin_img.copy()
 
     cv2.drawContours(highlight_img, contours, -1, 255, -1)
 
-    # for contour in contours:
-    #     x, y, w, h = cv2.boundingRect(contour)
-    #     draw_region(highlight_img, x, y, x + w, y + h)
-
-    for contour_1 in contours:
-        for contour_2 in contours:
-            x1, y1, w1, h1 = cv2.boundingRect(contour_1)
-            x2, y2, w2, h2 = cv2.boundingRect(contour_2)
-            if (x1 != x2 or y1 != y2) and (y1 < y2 and y1 + h1 + h1//4 >= y2 - h2//4):
-                x_left = max(x1, x2)
-                x_right = min(x1 + w1, x2 + w2)
-                if x_left < x_right:
-                    draw_region(highlight_img, x_left, y1 + h1, x_right, y2)
-    contours = cv2.findContours(highlight_img, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[-2]
+    rects = line_rects(contours)
+    x, y, w, h = rects.T
+    upper, lower = adjacent_line_pairs(rects)
+    x_left = np.maximum(x[upper], x[lower])
+    x_right = np.minimum(x[upper] + w[upper], x[lower] + w[lower])
+    for x1, y1, x2, y2 in zip(x_left.tolist(), (y[upper] + h[upper]).tolist(), x_right.tolist(), y[lower].tolist()):
+        draw_region(highlight_img, x1, y1, x2, y2)
+    return cv2.findContours(highlight_img, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[-2]
+
+def row_bands(contour):
+    """
+        First and last column of every row of a filled contour, cut into
+        bands of rows with the same ones. The extremes of a row are always
+        on the outer contour, so they are taken from its points, not from a
+        filled mask: CHAIN_APPROX_SIMPLE keeps the ends of horizontal,
+        vertical and diagonal runs, which are expanded back to every pixel.
+        Return the band tops, bottoms (exclusive), lefts and rights
+        (exclusive) as arrays.
+    """
+    start = contour.reshape(-1, 2).astype(np.int64)
+    step = np.concatenate([start[1:], start[:1]]) - start
+    count = np.maximum(np.abs(step).max(axis=1), 1)
+    run = np.repeat(np.arange(len(start)), count)
+    t = np.arange(len(run)) - np.repeat(np.cumsum(count) - count, count)
+    x, y = (start[run] + np.sign(step[run]) * t[:, None]).T
+
+    top = y.min()
+    left = np.full(y.max() - top + 1, x.max(), np.int64)
+    right = np.full(len(left), x.min(), np.int64)
+    np.minimum.at(left, y - top, x)
+    np.maximum.at(right, y - top, x)
+    right += 1
+    cut = np.flatnonzero((np.diff(left) != 0) | (np.diff(right) != 0)) + 1
+    tops = np.concatenate(([0], cut))
+    bottoms = np.append(cut, len(left))
+    return tops + top, bottoms + top, left[tops], right[tops]
+
+def merge_bands(tops, bottoms, lefts, rights, tolerance, max_vertices):
+    """
+        Merge neighbouring bands into one as wide as both, cheapest (least
+        added area) first: bands that only touch at a corner, then bands
+        whose sides move by at most tolerance, then any until the outline
+        has at most max_vertices vertices. Return the remaining bands as
+        lists in the same form.
+    """
+    tops, bottoms, lefts, rights = tops.tolist(), bottoms.tolist(), lefts.tolist(), rights.tolist()
+    n = len(tops)
+    nxt, prv = list(range(1, n + 1)), list(range(-1, n - 1))
+    version = [0] * n
+
+    def changes(i, j):
+        # vertices at the boundary of band i and the band j below it
+        if i < 0 or j >= n:
+            return 0
+        return 2 * ((lefts[i] != lefts[j]) + (rights[i] != rights[j]))
+
+    def cost(i):
+        j = nxt[i]
+        left, right = min(lefts[i], lefts[j]), max(rights[i], rights[j])
+        area = (bottoms[i] - tops[i]) * (right - left - rights[i] + lefts[i]) + \
+            (bottoms[j] - tops[j]) * (right - left - rights[j] + lefts[j])
+        if lefts[j] >= rights[i] or lefts[i] >= rights[j]:
+            return 0, area
+        jump = max(abs(lefts[i] - lefts[j]), abs(rights[i] - rights[j]))
+        return (1 if jump <= tolerance else 2), area
+
+    vertices = 4 + sum(changes(i, i + 1) for i in range(n - 1))
+    heap = [cost(i) + (i, 0) for i in range(n - 1)]
+    heapq.heapify(heap)
+    while heap:
+        kind, _, i, v = heapq.heappop(heap)
+        if v != version[i] or nxt[i] >= n:
+            continue
+        if kind == 2 and (max_vertices <= 0 or vertices <= max_vertices):
+            break
+        j = nxt[i]
+        vertices -= changes(prv[i], i) + changes(i, j) + changes(j, nxt[j])
+        lefts[i], rights[i] = min(lefts[i], lefts[j]), max(rights[i], rights[j])
+        bottoms[i] = bottoms[j]
+        version[j] += 1
+        nxt[i] = nxt[j]
+        if nxt[i] < n:
+            prv[nxt[i]] = i
+        vertices += changes(prv[i], i) + changes(i, nxt[i])
+        for k in (prv[i], i):
+            if k >= 0 and nxt[k] < n:
+                version[k] += 1
+                heapq.heappush(heap, cost(k) + (k, version[k]))
+
+    bands = []
+    i = 0
+    while i < n:
+        bands.append((tops[i], bottoms[i], lefts[i], rights[i]))
+        i = nxt[i]
+    return [list(band) for band in zip(*bands)]
+
+def contour_2_points(contour, tolerance=None, max_vertices=None):
+    """
+        Axis-aligned polygon around the filled contour, clockwise from the
+        top left, on pixel edges. With tolerance 0 and no vertex cap it
+        covers exactly the pixels between the first and last of every row.
+        Defaults are OUTLINE_TOLERANCE and MAX_VERTICES.
+    """
+    tolerance = OUTLINE_TOLERANCE if tolerance is None else tolerance
+    max_vertices = MAX_VERTICES if max_vertices is None else max_vertices
+    tops, bottoms, lefts, rights = merge_bands(*row_bands(contour), tolerance, max_vertices)
+    points = [(lefts[0], tops[0]), (rights[0], tops[0])]
+    for k in range(len(tops) - 1):
+        if rights[k] != rights[k + 1]:
+            points += [(rights[k], bottoms[k]), (rights[k + 1], bottoms[k])]
+    points += [(rights[-1], bottoms[-1]), (lefts[-1], bottoms[-1])]
+    for k in range(len(tops) - 2, -1, -1):
+        if lefts[k] != lefts[k + 1]:
+            points += [(lefts[k + 1], bottoms[k]), (lefts[k], bottoms[k])]
+    return points
+
+def merge_lines_2_paragraph(bin_img, contours):
+    contours = fill_paragraphs(bin_img, contours)
 
     if (len(contours) == 0):
         return []
-    idx = -1
-    for i in range(len(contours)):
-        if idx == -1 or cv2.contourArea(contours[idx]) < cv2.contourArea(contours[i]):
-            idx = i
-    epsilon = 0.001*cv2.arcLength(contours[idx], True)
-    approx = cv2.approxPolyDP(contours[idx], epsilon, True)
+    areas = np.array([cv2.contourArea(contour) for contour in contours])
+    idx = int(np.argmax(areas))
+    points = contour_2_points(contours[idx])
 
-    highlight_img = bin_img.copy()
-    for i in range(len(approx)):
-        j = (i + 1) % len(approx)
-        cv2.line(highlight_img, (approx[i][0][0], approx[i][0][1]), (approx[j][0][0], approx[j][0][1]), 255)
-    cv2.imwrite('highlight.png', highlight_img)
+    if DEBUG:
+        highlight_img = bin_img.copy()
+        cv2.polylines(highlight_img, [np.array(points, dtype=np.int32)], True, 255)
+        dump('highlight.png', highlight_img)
+
+    return points
 
-    return [(approx[i][0][0], approx[i][0][1]) for i in range(len(approx))]
+def merge_lines_2_paragraphs(bin_img, contours, min_area=MIN_REGION_AREA):
+    """
+        Like merge_lines_2_paragraph but keep every region of at least
+        min_area pixels, top to bottom then left to right
+    """
+    contours = [contour for contour in fill_paragraphs(bin_img, contours)
+                if cv2.contourArea(contour) >= min_area]
+    contours.sort(key=lambda contour: cv2.boundingRect(contour)[1::-1])
 
-def main(img):
-    cv2.imwrite('crop.png', img)
+    if DEBUG:
+        highlight_img = bin_img.copy()
+        cv2.drawContours(highlight_img, contours, -1, 255, 1)
+        dump('highlight.png', highlight_img)
+
+    return [contour_2_points(contour) for contour in contours]
+
+def words_2_paragraph(bin_img, list_bboxes, timing=None):
+    t = time.perf_counter()
+    line_contours = merge_words_2_line(bin_img, list_bboxes)
+    t = lap(timing, 'line', t)
+    points = merge_lines_2_paragraph(bin_img, line_contours)
+    lap(timing, 'paragraph', t)
+    return points
+
+def main(img, timing=None):
+    timing = timing or TIMING
+    dump('crop.png', img)
+    start = time.perf_counter()
     bin_img = binarize(img)
+    t = lap(timing, 'binarize', start)
     list_bboxes = bbox_words(bin_img)
-    line_contours = merge_words_2_line(bin_img, list_bboxes)
-    return merge_lines_2_paragraph(bin_img, line_contours)
+    lap(timing, 'bbox_words', t)
+    points = words_2_paragraph(bin_img, list_bboxes, timing)
+    lap(timing, 'total', start)
+    return points
+
+def tiles(shape, tile_size=TILE_SIZE, margin=TILE_MARGIN):
+    """
+        Split an image of the given shape into tile_size cores, each read
+        with margin extra pixels on every side.
+
+        Return a list of (core, extended) rects as (x1, y1, x2, y2)
+    """
+    h, w = shape[:2]
+    result = []
+    for y in range(0, h, tile_size):
+        for x in range(0, w, tile_size):
+            core = (x, y, min(x + tile_size, w), min(y + tile_size, h))
+            extended = (max(0, x - margin), max(0, y - margin), min(w, core[2] + margin), min(h, core[3] + margin))
+            result.append((core, extended))
+    return result
+
+def tile_bbox_words(bin_img, core, extended, margin=TILE_MARGIN):
+    """
+        Word boxes of one tile in page coordinates, those whose top-left
+        corner lies in the core so words inside the margin are only found
+        once. A component no larger than the margin that reaches the core
+        lies whole in the extended tile, together with everything it
+        encloses, so the tile finds the same boxes as the whole page.
+
+        Return the boxes and whether the tile has a larger component, for
+        which that does not hold (cut by the tile border, or hiding words
+        in its holes from one tile but not from another).
+    """
+    ex1, ey1, ex2, ey2 = extended
+    boxes = np.array(bbox_words(bin_img[ey1:ey2, ex1:ex2]), dtype=np.int64).reshape(-1, 4)
+    boxes[:, :2] += (ex1, ey1)
+
+    x1, y1 = boxes[:, 0] + PADDING, boxes[:, 1] + PADDING
+    in_core = (core[0] <= x1) & (x1 < core[2]) & (core[1] <= y1) & (y1 < core[3])
+    large = np.any(boxes[:, 2:] - 2*PADDING >= margin)
+    return boxes[in_core], large
+
+def page_bbox_words(bin_img, tile_size=TILE_SIZE, jobs=None):
+    """
+        bbox_words over a large binary image, found tile by tile on a thread
+        pool. OpenCV releases the GIL, so the tiles run on all cores. Pages
+        with components larger than the tile margin (frames, rules, big
+        rings) are done in one pass, so the result is always the same as
+        bbox_words of the whole page.
+    """
+    parts = tiles(bin_img.shape, tile_size)
+    if len(parts) == 1 or (jobs or os.cpu_count() or 1) == 1:
+        return bbox_words(bin_img)
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        results = list(pool.map(lambda part: tile_bbox_words(bin_img, *part), parts))
+    if any(large for _, large in results):
+        return bbox_words(bin_img)
+    return [tuple(box) for box in np.concatenate([boxes for boxes, _ in results]).tolist()]
+
+def words_2_paragraphs(bin_img, list_bboxes, min_area=MIN_REGION_AREA, timing=None):
+    t = time.perf_counter()
+    line_img = draw_lines(bin_img, group_column_lines(list_bboxes).tolist())
+    dump('line.png', line_img)
+    line_contours = cv2.findContours(line_img, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[-2]
+    t = lap(timing, 'line', t)
+    polygons = merge_lines_2_paragraphs(bin_img, line_contours, min_area)
+    lap(timing, 'paragraph', t)
+    return polygons
+
+def segment(img, min_area=MIN_REGION_AREA, tile_size=TILE_SIZE, jobs=None, timing=None):
+    """
+        Find every paragraph / block of a whole page (or a big crop) in one
+        pass. Return a list of polygons, each a list of points in order
+    """
+    timing = timing or TIMING
+    dump('crop.png', img)
+    start = time.perf_counter()
+    bin_img = binarize(img)
+    t = lap(timing, 'binarize', start)
+    list_bboxes = page_bbox_words(bin_img, tile_size, jobs)
+    lap(timing, 'bbox_words', t)
+    polygons = words_2_paragraphs(bin_img, list_bboxes, min_area, timing)
+    lap(timing, 'total', start)
+    return polygons
+
+class PageIndex:
+    """
+        Binary image and word components of a whole page, computed once
+        (one global Otsu threshold) so that main / segment on a region of
+        the page are range queries instead of a fresh binarize and
+        findContours of the crop.
+    """
+    def __init__(self, img, tile_size=TILE_SIZE, jobs=None):
+        self.bin_img = binarize(img)
+        # unpadded component rects, sorted by top edge
+        rects = np.array(page_bbox_words(self.bin_img, tile_size, jobs), dtype=np.int64).reshape(-1, 4)
+        rects[:, :2] += PADDING
+        rects[:, 2:] -= 2*PADDING
+        self.rects = rects[np.argsort(rects[:, 1], kind='stable')]
+        self.max_h = int(self.rects[:, 3].max()) if len(self.rects) > 0 else 0
+
+    def bbox_words(self, x1, y1, x2, y2):
+        """
+            Word boxes of the region as bbox_words would return them for the
+            crop, in crop coordinates. Components inside the region come from
+            the index; only those cut by the region border are looked up
+            again in the binary image, since the cut may split or shrink them
+            and open their holes.
+        """
+        tops = self.rects[:, 1]
+        rects = self.rects[np.searchsorted(tops, y1 - self.max_h):np.searchsorted(tops, y2)]
+        x, y, w, h = rects.T
+        rects = rects[(x < x2) & (x + w > x1) & (y + h > y1)]
+        x, y, w, h = rects.T
+        inside = (x1 <= x) & (x + w <= x2) & (y1 <= y) & (y + h <= y2)
+
+        pieces = []
+        for cx, cy, cw, ch in rects[~inside].tolist():
+            left, top, right, bottom = max(cx, x1), max(cy, y1), min(cx + cw, x2), min(cy + ch, y2)
+            own, hole = self.cut_component(cx, cy, cw, ch)
+            sub_img = self.bin_img[top:bottom, left:right]
+            for contour in cv2.findContours(sub_img, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[-2]:
+                # keep parts of the cut component and words in its holes, the
+                # window also holds clipped parts of neighbouring components
+                px, py = contour[0][0]
+                px, py = px + left - cx, py + top - cy
+                if own[py, px] or hole[py, px]:
+                    px, py, pw, ph = cv2.boundingRect(contour)
+                    pieces.append((px + left - x1, py + top - y1, pw, ph))
+
+        boxes = (rects[inside] - (x1, y1, 0, 0)).tolist() + list(set(pieces))
+        return [(bx - PADDING, by - PADDING, bw + 2*PADDING, bh + 2*PADDING) for bx, by, bw, bh in boxes]
+
+    def cut_component(self, x, y, w, h):
+        """
+            Masks of the component with the bounding box (x, y, w, h) and of
+            its holes, in box coordinates. The component is the one spanning
+            the whole box; a hole is background not connected to the border
+            of the box.
+        """
+        _, labels, stats, _ = cv2.connectedComponentsWithStats(self.bin_img[y:y + h, x:x + w], connectivity=8)
+        own = np.isin(labels, np.flatnonzero((stats[1:, 2] == w) & (stats[1:, 3] == h)) + 1)
+        _, regions = cv2.connectedComponents(np.uint8(~own), connectivity=4)
+        border = np.unique(np.concatenate([regions[0], regions[-1], regions[:, 0], regions[:, -1]]))
+        hole = ~own & ~np.isin(regions, border)
+        return own, hole
+
+    def main(self, x1, y1, x2, y2, timing=None):
+        timing = timing or TIMING
+        start = time.perf_counter()
+        bin_img = self.bin_img[y1:y2, x1:x2]
+        list_bboxes = self.bbox_words(x1, y1, x2, y2)
+        lap(timing, 'bbox_words', start)
+        points = words_2_paragraph(bin_img, list_bboxes, timing)
+        lap(timing, 'total', start)
+        return points
+
+    def segment(self, x1, y1, x2, y2, min_area=MIN_REGION_AREA, timing=None):
+        timing = timing or TIMING
+        start = time.perf_counter()
+        bin_img = self.bin_img[y1:y2, x1:x2]
+        list_bboxes = self.bbox_words(x1, y1, x2, y2)
+        lap(timing, 'bbox_words', start)
+        polygons = words_2_paragraphs(bin_img, list_bboxes, min_area, timing)
+        lap(timing, 'total', start)
+        return polygons
+
+def verify(img_paths):
+    """
+        Compare merge_words_2_line against merge_words_2_line_legacy on every
+        image, print the line count, mask IoU and whether the final polygon
+        is identical. Return True if all images give the same lines.
+    """
+    all_same = True
+    for img_path in img_paths:
+        img = cv2.imread(img_path)
+        if img is None:
+            continue
+        bin_img = binarize(img)
+        # the legacy merge depends on the order of boxes with the same top,
+        # group_lines sorts them by left edge
+        list_bboxes = sorted(bbox_words(bin_img), key=lambda bbox: (bbox[1], bbox[0], bbox[2], bbox[3]))
+
+        legacy = merge_words_2_line_legacy(bin_img, list_bboxes)
+        fast = merge_words_2_line(bin_img, list_bboxes)
+
+        legacy_mask = cv2.drawContours(np.zeros_like(bin_img), legacy, -1, 255, -1) > 0
+        fast_mask = cv2.drawContours(np.zeros_like(bin_img), fast, -1, 255, -1) > 0
+        union = np.count_nonzero(legacy_mask | fast_mask)
+        iou = np.count_nonzero(legacy_mask & fast_mask) / union if union else 1.0
+
+        same = len(legacy) == len(fast) and iou == 1.0 and \
+            merge_lines_2_paragraph(bin_img, legacy) == merge_lines_2_paragraph(bin_img, fast)
+        all_same = all_same and same
+        print('%s: %d words, %d/%d lines, IoU %.4f, %s' % (img_path, len(list_bboxes),
+            len(legacy), len(fast), iou, 'same' if same else 'DIFFERENT'))
+    return all_same
+
+def verify_random(runs=2000, seed=0):
+    """
+        Compare merge_words_2_line against merge_words_2_line_legacy on
+        random box sets, dense enough to overlap, nest and share top edges,
+        with the input reversed for the fast merge. Return True if every set
+        gives the same line mask.
+    """
+    rng = np.random.default_rng(seed)
+    img = np.zeros((160, 160), np.uint8)
+    different = 0
+    for _ in range(runs):
+        count, size = int(rng.integers(1, 30)), int(rng.integers(10, 120))
+        boxes = np.concatenate([rng.integers(0, size, (count, 2)), rng.integers(1, 30, (count, 2))], axis=1)
+        boxes = sorted(map(tuple, boxes.tolist()), key=lambda bbox: (bbox[1], bbox[0], bbox[2], bbox[3]))
+        legacy = cv2.drawContours(np.zeros_like(img), merge_words_2_line_legacy(img, boxes), -1, 255, -1)
+        fast = cv2.drawContours(np.zeros_like(img), merge_words_2_line(img, boxes[::-1]), -1, 255, -1)
+        different += not np.array_equal(legacy, fast)
+    print('%d random box sets: %d different' % (runs, different))
+    return different == 0
+
+def verify_index(img_paths, runs=300, seed=0):
+    """
+        Compare PageIndex.bbox_words against bbox_words of the crop on
+        random regions of every image. Return True if every region gives
+        the same boxes.
+    """
+    rng = np.random.default_rng(seed)
+    all_same = True
+    for img_path in img_paths:
+        img = cv2.imread(img_path)
+        if img is None:
+            continue
+        index = PageIndex(img)
+        height, width = index.bin_img.shape
+        different = 0
+        for _ in range(runs):
+            x1, x2 = sorted(rng.integers(0, width + 1, 2).tolist())
+            y1, y2 = sorted(rng.integers(0, height + 1, 2).tolist())
+            if x2 - x1 < 2 or y2 - y1 < 2:
+                continue
+            different += sorted(index.bbox_words(x1, y1, x2, y2)) != sorted(bbox_words(index.bin_img[y1:y2, x1:x2]))
+        all_same = all_same and different == 0
+        print('%s: %d random regions, %d different' % (img_path, runs, different))
+    return all_same
 
 if __name__ == '__main__':
-    img_path = sys.argv[1]
-    img = cv2.imread(img_path)
-    print(main(img))
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Find the paragraph polygon of an image')
+    parser.add_argument('images', nargs='*')
+    parser.add_argument('--all', action='store_true', help='print every paragraph polygon, not only the largest')
+    parser.add_argument('--verify', action='store_true',
+        help='compare the line merge against the legacy all-pairs merge and the page index against '
+             'the crop (default: data/)')
+    parser.add_argument('--debug', action='store_true', help='write crop.png, line.png and highlight.png')
+    parser.add_argument('--timing', action='store_true', help='print wall time of every stage')
+    parser.add_argument('--tolerance', type=int, default=OUTLINE_TOLERANCE,
+        help='outline steps of at most this many pixels are smoothed away')
+    parser.add_argument('--max-vertices', type=int, default=MAX_VERTICES, help='vertices per polygon, 0 for no cap')
+    args = parser.parse_args()
+
+    DEBUG = DEBUG or args.debug
+    OUTLINE_TOLERANCE, MAX_VERTICES = args.tolerance, args.max_vertices
+    if args.timing:
+        TIMING = print_timing
+
+    if args.verify:
+        img_paths = args.images or sorted(glob.glob(os.path.join('data', 'segment_*.*')))
+        img_paths = [p for p in img_paths if not p.endswith('.json')]
+        same = verify(img_paths)
+        same = verify_index(img_paths) and same
+        sys.exit(0 if verify_random() and same else 1)
+
+    for img_path in args.images:
+        img = cv2.imread(img_path)
+        print(segment(img) if args.all else main(img))
@@ -1,35 +1,124 @@
-from qtpy.QtCore import QRectF
+from qtpy.QtCore import QRectF, QPointF
 from qtpy.QtGui import QPolygonF
 from qtpy.QtCore import Qt
 
+import numpy as np
+
+def as_coords(points):
+    # (n, 2) float64 array of x, y from QPointFs, (x, y) pairs or an array
+    if len(points) > 0 and isinstance(points[0], QPointF):
+        points = [(point.x(), point.y()) for point in points]
+    return np.array(points, dtype=np.float64).reshape(-1, 2)
+
+def to_polygon(coords):
+    """
+        QPolygonF over a copy of coords made with one memmove: QPointF is two
+        doubles, so an (n, 2) float64 array has the same layout as the
+        polygon's point vector
+    """
+    polygon = QPolygonF(len(coords))
+    try:
+        ptr = polygon.data()
+        ptr.setsize(coords.nbytes)
+    except (AttributeError, TypeError):
+        # bindings without sip pointers
+        return QPolygonF([QPointF(x, y) for x, y in coords.tolist()])
+    np.frombuffer(ptr, np.float64)[:] = np.ascontiguousarray(coords).ravel()
+    return polygon
+
+def from_json(data_obj):
+    """
+        Rectangle or Polygon of an object of a label file, None for other
+        types and for objects without points (or a rectangle not made of two)
+    """
+    cls = {'rectangle': Rectangle, 'polygon': Polygon}.get(data_obj['type'])
+    if cls is None:
+        return None
+    points = data_obj['points']
+    if len(points) == 0 or (cls is Rectangle and len(points) != 2):
+        return None
+    coords = np.fromiter((value for point in points for value in (point['x'], point['y'])),
+                         np.float64, 2 * len(points)).reshape(-1, 2)
+    return cls(coords, data_obj['label'])
+
 class Obj:
+    """
+        Label and points of an object, the points are one contiguous (n, 2)
+        array instead of a QPointF per point
+    """
+    __slots__ = ('coords', 'label')
+
     def __init__(self, p, label = ""):
-        self.points = p
+        self.coords = as_coords(p)
         self.label = label
 
     def set_label(self, label):
         self.label = label
 
+    def bounds(self):
+        (x1, y1), (x2, y2) = self.coords.min(axis=0).tolist(), self.coords.max(axis=0).tolist()
+        return x1, y1, x2, y2
+
+    def translate(self, dx, dy):
+        self.coords += (dx, dy)
+
+    def handles(self):
+        return [QPointF(x, y) for x, y in self.coords.tolist()]
+
+    def move_handle(self, i, pos):
+        self.coords[i] = pos.x(), pos.y()
+
+    def normalize(self):
+        pass
+
     def export_json(self, data_obj, obj_type):
         data_obj['type'] = obj_type
         data_obj['label'] = self.label
-        data_obj['points'] = []
-        for point in self.points:
-            data_obj['points'].append({
-                'x': point.x(),
-                'y': point.y(),
-            })
+        data_obj['points'] = [{'x': x, 'y': y} for x, y in self.coords.tolist()]
 
 class Rectangle(Obj):
+    __slots__ = ()
+
     def draw(self, painter):
-        painter.drawRect(QRectF(self.points[0], self.points[1]))
+        (x1, y1), (x2, y2) = self.coords.tolist()
+        painter.drawRect(QRectF(QPointF(x1, y1), QPointF(x2, y2)))
+
+    def contains(self, pos, margin=0):
+        (x1, x2), (y1, y2) = sorted(self.coords[:, 0].tolist()), sorted(self.coords[:, 1].tolist())
+        return x1 - margin <= pos.x() <= x2 + margin and y1 - margin <= pos.y() <= y2 + margin
+
+    def handles(self):
+        # the four corners, clockwise from the first point
+        (x1, y1), (x2, y2) = self.coords.tolist()
+        return [QPointF(x1, y1), QPointF(x2, y1), QPointF(x2, y2), QPointF(x1, y2)]
+
+    def move_handle(self, i, pos):
+        # each corner takes its x from one of the points and its y from one
+        self.coords[(0, 1, 1, 0)[i], 0] = pos.x()
+        self.coords[(0, 0, 1, 1)[i], 1] = pos.y()
+
+    def normalize(self):
+        # a corner dragged past the opposite one
+        self.coords = np.array([self.coords.min(axis=0), self.coords.max(axis=0)])
 
     def export_json(self, data_obj):
         super(Rectangle, self).export_json(data_obj, 'rectangle')
 
 class Polygon(Obj):
+    __slots__ = ()
+
     def draw(self, painter):
-        painter.drawPolygon(QPolygonF(self.points))
+        painter.drawPolygon(to_polygon(self.coords))
+
+    def contains(self, pos, margin=0):
+        # inside, or on the outline give or take margin
+        if to_polygon(self.coords).containsPoint(pos, Qt.OddEvenFill):
+            return True
+        a = self.coords
+        d = np.roll(a, -1, axis=0) - a
+        p = np.array([pos.x(), pos.y()]) - a
+        t = np.clip((p * d).sum(axis=1) / np.maximum((d * d).sum(axis=1), 1e-12), 0, 1)
+        return bool((np.hypot(*(p - t[:, None] * d).T) <= margin).any())
 
     def export_json(self, data_obj):
-        super(Polygon, self).export_json(data_obj, 'polygon')
\ No newline at end of file
+        super(Polygon, self).export_json(data_obj, 'polygon')
@@ -0,0 +1,80 @@
+"""
+    Uniform grid over object bounding boxes
+
+        - Every object is registered in the grid cells its box overlaps,
+          so a point query only looks at the objects of one cell, and a
+          rectangle query at those of the cells it covers
+        - insert / remove / update are proportional to the cells an object
+          covers, independent of the number of objects on the page
+"""
+
+# in image pixels
+CELL = 64
+
+class GridIndex:
+    def __init__(self, cell=CELL):
+        self.cell = cell
+        # (cx, cy) -> keys of the objects overlapping the cell
+        self.cells = {}
+        # key -> (x1, y1, x2, y2)
+        self.boxes = {}
+
+    def cell_range(self, box):
+        x1, y1, x2, y2 = box
+        c = self.cell
+        return [(cx, cy) for cy in range(int(y1 // c), int(y2 // c) + 1)
+                         for cx in range(int(x1 // c), int(x2 // c) + 1)]
+
+    def insert(self, key, box):
+        self.boxes[key] = box
+        for cell in self.cell_range(box):
+            self.cells.setdefault(cell, set()).add(key)
+
+    def remove(self, key):
+        box = self.boxes.pop(key, None)
+        if box is None:
+            return
+        for cell in self.cell_range(box):
+            keys = self.cells[cell]
+            keys.discard(key)
+            if len(keys) == 0:
+                del self.cells[cell]
+
+    def update(self, key, box):
+        self.remove(key)
+        self.insert(key, box)
+
+    def clear(self):
+        self.cells = {}
+        self.boxes = {}
+
+    def at(self, x, y, margin=0):
+        """
+            Keys whose box, grown by margin, contains x, y
+        """
+        # every cell the margin covers, it can span several at low zoom
+        cells = self.cell_range((x - margin, y - margin, x + margin, y + margin))
+        if len(cells) > len(self.boxes):
+            found = self.boxes
+        else:
+            found = set()
+            for cell in cells:
+                found.update(self.cells.get(cell, ()))
+        return [key for key in found
+                if self.boxes[key][0] - margin <= x <= self.boxes[key][2] + margin and
+                   self.boxes[key][1] - margin <= y <= self.boxes[key][3] + margin]
+
+    def overlapping(self, x1, y1, x2, y2):
+        """
+            Keys whose box overlaps the rectangle x1, y1, x2, y2
+        """
+        cells = self.cell_range((x1, y1, x2, y2))
+        if len(cells) > len(self.boxes):
+            found = self.boxes
+        else:
+            found = set()
+            for cell in cells:
+                found.update(self.cells.get(cell, ()))
+        return [key for key in found
+                if self.boxes[key][0] <= x2 and x1 <= self.boxes[key][2] and
+                   self.boxes[key][1] <= y2 and y1 <= self.boxes[key][3]]
@@ -1,87 +1,256 @@
 from qtpy.QtWidgets import QWidget, QListWidgetItem
-from qtpy.QtGui import QPixmap, QPainter, QCursor, QColor, QPen
-from qtpy.QtCore import QPointF, Qt, QFile
+from qtpy.QtGui import QImage, QPixmap, QPainter, QCursor, QColor, QPen
+from qtpy.QtCore import QPointF, QRectF, Qt, QFile, QTimer, Signal
+import shape
 from shape import Rectangle, Polygon
 from widgets.label_dialog import LabelDialog
-
-import cv2
-import rectilinear_polygon
+from widgets.preview_worker import PreviewWorker
+from widgets.label_writer import LabelWriter
+
+from polygon_cache import PolygonCache, image_hash
+from image_cache import ImageCache
+from spatial_index import GridIndex
+from edit_history import EditHistory
+from label_store import LabelStore, STORE
+from label_files import label_path
+from image_pyramid import ImagePyramid, pyramid_key, prune, PYRAMID_MIN_PIXELS, TILE
 import json
 import datetime
 import os
+import numpy as np
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# zoomed image and object layer are only cached up to this many pixels
+MAX_CACHED_PIXELS = 32 * 1024 * 1024
+
+# pyramid tiles kept as QImages, 1MB each
+MAX_TILE_IMAGES = 128
+
+MIN_SCALE, MAX_SCALE = 0.01, 5
+
+# edits within this many ms of each other are saved together
+AUTOSAVE_DELAY = int(os.environ.get('CLABEL_AUTOSAVE_DELAY', 500))
+
+def pipeline():
+    # OpenCV and the auto-polygon pipeline are imported on first use, so
+    # the window opens without waiting for them
+    import rectilinear_polygon
+    return rectilinear_polygon
+
+def page_index(img):
+    return pipeline().PageIndex(img)
+
+def load_image(image_dir):
+    """
+        Decode once into a BGRA buffer used both by OpenCV and, without a
+        copy, by the QImage that is drawn (Format_RGB32 is BGRA in memory
+        on little-endian machines). Runs on the prefetch threads.
+    """
+    import cv2
+    img = cv2.imread(image_dir)
+    if img is not None:
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2BGRA)
+    else:
+        # formats OpenCV cannot decode (svg, ico, xpm, ...) are read by Qt
+        image = QImage(image_dir)
+        if image.isNull():
+            return QImage(), None
+        image = image.convertToFormat(QImage.Format_RGB32)
+        w, h = image.width(), image.height()
+        ptr = image.constBits()
+        if hasattr(ptr, 'setsize'):
+            ptr.setsize(image.bytesPerLine() * h)
+        rows = np.frombuffer(ptr, np.uint8).reshape(h, image.bytesPerLine())
+        img = rows[:, :w * 4].reshape(h, w, 4).copy()
+    return QImage(img.data, img.shape[1], img.shape[0], img.strides[0], QImage.Format_RGB32), img
+
+def image_bytes(image):
+    _, cv2_image = image
+    return cv2_image.nbytes if cv2_image is not None else 0
 
 class Canvas(QWidget):
+    # a pyramid tile was made on the tile thread
+    tile_ready = Signal()
+
     def __init__(self, parent):
         super(Canvas, self).__init__()
 
-        self.SELECT, self.RECTANGLE, self.AUTO_POLYGON, self.POLYGON = 0, 1, 2, 3
+        self.SELECT, self.RECTANGLE, self.AUTO_POLYGON, self.POLYGON, self.AUTO_SEGMENT = 0, 1, 2, 3, 4
 
         self._painter = QPainter()
         self.pixmap = None
         self.cv2_image = None
+        self.image_cache = ImageCache(load_image, image_bytes)
+        # binary image and word components of the page, built in the background
+        self.page_index_future = None
+        self.image_hash_future = None
+        self.index_pool = ThreadPoolExecutor(max_workers=1)
+        self.polygon_cache = PolygonCache()
+        # tiles of large images, only the visible ones are made and drawn
+        self.pyramid = None
+        self.tile_images = OrderedDict()
+        self.tile_futures = {}
+        self.tile_pool = ThreadPoolExecutor(max_workers=1)
+        self.tile_ready.connect(self.update)
+        # auto-polygon result for the region under the mouse, shown until
+        # the second click confirms it
+        self.preview_worker = PreviewWorker()
+        self.preview_worker.done.connect(self.show_preview)
+        self.preview_key = None
+        self.preview = None
+        # the second click came before the preview was ready, it is added
+        # when it arrives
+        self.confirmed = False
+        self.cursor_pos = None
+        self.setMouseTracking(True)
+        # labels of the whole dataset in one file, if configured
+        self.label_store = LabelStore(STORE) if STORE else None
+        self.label_writer = LabelWriter(self.label_store)
+        self.label_writer.saved.connect(self.label_saved)
+        self.save_timer = QTimer(self)
+        self.save_timer.setSingleShot(True)
+        self.save_timer.setInterval(AUTOSAVE_DELAY)
+        self.save_timer.timeout.connect(self.flush_labels)
+        self.dirty = False
         self.scale = 1.0
+        # image at the current zoom and the outlines of all objects, reused
+        # by paintEvent until the image, zoom or objects change
+        self.background = None
+        self.object_layer = None
         self.mode = self.SELECT
         self.label_dir = ""
         self.parent = parent
+        # the objects of the page, shared with the object list view
+        self.object_model = parent.object_list_model
+        self.object_model.rowsInserted.connect(self.objects_inserted)
+        self.object_model.rowsAboutToBeRemoved.connect(self.objects_removing)
+        self.object_model.rowsRemoved.connect(self.objects_removed)
+        self.object_model.modelReset.connect(self.objects_reset)
+        # bounding boxes of the objects, for hit-testing in SELECT mode
+        # and for redrawing part of the object layer
+        self.object_index = GridIndex()
+        # area of the objects being removed
+        self.removed_rect = None
+        self.hover_object = None
+        # [object, handle or -1 to move it, last position, moved yet,
+        # points before the drag]
+        self.drag = None
+        # undo / redo of the edits of every page opened in the session
+        self.history = EditHistory()
         self.reset()
 
-        self.labelDialog = LabelDialog(
-            parent=self,
-            listItem = self.parent.labels
-        )
+        self._label_dialog = None
+
+    @property
+    def labelDialog(self):
+        # built on first use, it is not shown at startup
+        if self._label_dialog is None:
+            self._label_dialog = LabelDialog(
+                parent=self,
+                label_index = self.parent.label_index
+            )
+        return self._label_dialog
+
+    @property
+    def objects(self):
+        return self.object_model.objects
 
     def reset(self):
         self.points = []
-        self.objects = []
+        self.clear_preview()
+        self.object_model.set_objects([])
         self.cur_object = -1
-        self.parent.load_object_list(self.objects)
 
     # load image and label file
     def load_file(self, image_dir):
+        self.flush_labels()
         self.reset()
-        self.pixmap = QPixmap(image_dir)
-        self.cv2_image = cv2.imread(image_dir)
-        self.label_dir = os.path.splitext(image_dir)[0] + '.json'
-        if QFile.exists(self.label_dir):
+        # a QImage drawn straight from the cv2_image buffer, not a QPixmap copy
+        self.pixmap, self.cv2_image = self.image_cache.get(image_dir)
+        self.load_pyramid(image_dir)
+        self.invalidate_background()
+        self.updateGeometry()
+        for future in (self.image_hash_future, self.page_index_future):
+            if future is not None:
+                future.cancel()
+        self.image_hash_future = self.page_index_future = None
+        if self.cv2_image is not None:
+            self.image_hash_future = self.index_pool.submit(image_hash, self.cv2_image)
+            self.page_index_future = self.index_pool.submit(page_index, self.cv2_image)
+        self.label_dir = label_path(image_dir)
+        # labels still queued for writing are newer than the file
+        data = self.label_writer.pending_data(self.label_dir)
+        if data is None and self.label_store is not None:
+            data = self.label_store.get(self.label_dir)
+        elif data is None and QFile.exists(self.label_dir):
             with open(self.label_dir) as json_file:
                 data = json.load(json_file)
-                self.objects = []
-                for obj in data['objects']:
-                    points = []
-                    for point in obj['points']:
-                        points.append(QPointF(point['x'], point['y']))
-                    if (obj['type'] == 'rectangle'):
-                        self.objects.append(Rectangle(points, obj['label']))
-                    elif (obj['type'] == 'polygon'):
-                        self.objects.append(Polygon(points, obj['label']))
-                self.cur_object = len(self.objects) - 1
-                self.parent.load_object_list(self.objects)
-                self.parent.object_list_widget.setCurrentRow(self.cur_object)
-
-
-        self.repaint()
+        if data is not None:
+            objects = [obj for obj in map(shape.from_json, data['objects']) if obj is not None]
+            self.object_model.set_objects(objects)
+            self.cur_object = len(self.objects) - 1
+            self.parent.select_object(self.cur_object)
+
+
+        self.update()
+
+    def load_pyramid(self, image_dir):
+        for future in self.tile_futures.values():
+            future.cancel()
+        self.tile_futures = {}
+        self.tile_images = OrderedDict()
+        self.pyramid = None
+        if self.cv2_image is None or self.cv2_image.shape[0] * self.cv2_image.shape[1] < PYRAMID_MIN_PIXELS:
+            return
+        key = pyramid_key(image_dir, self.cv2_image)
+        try:
+            self.pyramid = ImagePyramid(self.cv2_image, key)
+        except OSError:
+            # no writable tile directory, draw the image whole
+            return
+        self.tile_pool.submit(prune, keep=key)
+
+    def minimumSizeHint(self):
+        # the scroll area scrolls once the zoomed image is larger than it
+        if self.pixmap is None:
+            return super(Canvas, self).minimumSizeHint()
+        return self.pixmap.size() * self.scale
+
+    def sizeHint(self):
+        return self.minimumSizeHint()
 
     def offset_to_center(self):
+        # whole widget pixels, so cached layers and live drawing line up
         s = self.scale
         area = super(Canvas, self).size()
         w, h = self.pixmap.width() * s, self.pixmap.height() * s
         aw, ah = area.width(), area.height()
-        x = (aw - w) / (2 * s) if aw > w else 0
-        y = (ah - h) / (2 * s) if ah > h else 0
+        x = round((aw - w) / 2) / s if aw > w else 0
+        y = round((ah - h) / 2) / s if ah > h else 0
         return QPointF(x, y)
 
     def transform_pos(self, point):
+        # widget to full resolution image coordinates, at any zoom level
         return point / self.scale - self.offset_to_center()
 
     def rescale(self, value):
-        if value >= 0.2 and value <= 5:
+        if value >= MIN_SCALE and value <= MAX_SCALE:
             self.scale = value
-            self.repaint()
+            self.invalidate_background()
+            self.updateGeometry()
 
     def in_pixmap(self, p):
         w, h = self.pixmap.width(), self.pixmap.height()
         return (0 <= p.x() < w and 0 <= p.y() < h)
 
+    def region(self, p1, p2):
+        left_x = int(min(p1.x(), p2.x()))
+        right_x = int(max(p1.x(), p2.x()))
+        left_y = int(min(p1.y(), p2.y()))
+        right_y = int(max(p1.y(), p2.y()))
+        return left_x, left_y, right_x, right_y
+
     def close_enough(self, p1, p2):
         epsilon = 0.01
         return  abs(p1.x() - p2.x()) <= max(5, epsilon * self.pixmap.width()) and \
@@ -90,12 +259,12 @@ class Canvas(QWidget):
     def next_obj(self):
         if len(self.objects) > 0:
             self.cur_object = (self.cur_object + 1) % len(self.objects)
-            self.parent.object_list_widget.setCurrentRow(self.cur_object)
+            self.parent.select_object(self.cur_object)
 
     def prev_obj(self):
         if len(self.objects) > 0:
             self.cur_object = (self.cur_object + len(self.objects) - 1) % len(self.objects)
-            self.parent.object_list_widget.setCurrentRow(self.cur_object)
+            self.parent.select_object(self.cur_object)
 
     def del_obj(self):
         if len(self.objects) > 0:
@@ -103,22 +272,184 @@ class Canvas(QWidget):
                 new_id = self.cur_object - 1
             else:
                 new_id = self.cur_object
-            self.objects = self.objects[:self.cur_object] + self.objects[self.cur_object + 1:]
+            # the view moves its current row, and so cur_object, on remove
+            row = self.cur_object
+            obj = self.object_model.remove(row)
+            self.history.push(self.label_dir, ('delete', [[row, obj]]))
             self.cur_object = new_id
-            self.parent.load_object_list(self.objects)
-            self.parent.object_list_widget.setCurrentRow(self.cur_object)
-            self.repaint()
+            self.parent.select_object(self.cur_object)
+            self.update()
             self.auto_export_json()
 
-    def add_obj(self, obj):
-        self.objects.append(obj)
-        self.cur_object = len(self.objects) - 1
-        self.parent.load_object_list(self.objects)
-        self.parent.object_list_widget.setCurrentRow(self.cur_object)
-        self.repaint()
+    def add_obj(self, obj, record=True):
+        row = len(self.objects)
+        self.object_model.append(obj)
+        self.cur_object = row
+        if record:
+            self.history.push(self.label_dir, ('add', [[row, obj]]))
+        self.parent.select_object(self.cur_object)
+        self.update()
         self.auto_export_json()
+        return row
+
+    def relabel_obj(self, row):
+        if 0 <= row < len(self.objects):
+            old = self.objects[row].label
+            text = self.labelDialog.pop_up(old or '')
+            if text is not None:
+                self.object_model.relabel(row, text)
+                self.history.push(self.label_dir, ('relabel', row, old, text))
+                self.auto_export_json()
+
+    def add_polygons(self, polygons, left_x=0, left_y=0):
+        if len(polygons) > 0:
+            text = self.labelDialog.pop_up()
+            added = []
+            for tmp in polygons:
+                obj = Polygon(np.asarray(tmp, dtype=np.float64) + (left_x, left_y), text)
+                added.append([self.add_obj(obj, record=False), obj])
+            # one undo step for the whole segmentation
+            self.history.push(self.label_dir, ('add', added))
+
+    def undo(self):
+        command = self.history.undo(self.label_dir)
+        if command is not None:
+            self.apply(command, reverse=True)
+
+    def redo(self):
+        command = self.history.redo(self.label_dir)
+        if command is not None:
+            self.apply(command)
+
+    def apply(self, command, reverse=False):
+        """
+            Redo command, or undo it if reverse. Rows are those of the page
+            when it was recorded; if the label file was changed outside the
+            app since, the history of the page is dropped.
+        """
+        kind = command[0]
+        rows = [row for row, _ in command[1]] if kind in ('add', 'delete') else [command[1]]
+        inserting = kind in ('add', 'delete') and (kind == 'add') != reverse
+        if (rows[0] > len(self.objects)) if inserting else (max(rows) >= len(self.objects)):
+            self.history.clear(self.label_dir)
+            return
+        if inserting:
+            for row, obj in command[1]:
+                self.object_model.insert(row, obj)
+            self.cur_object = rows[-1]
+        elif kind in ('add', 'delete'):
+            # keep the objects as they were removed, for the next redo
+            for item in reversed(command[1]):
+                item[1] = self.object_model.remove(item[0])
+            self.cur_object = min(rows[0], len(self.objects) - 1)
+        elif kind == 'relabel':
+            self.object_model.relabel(rows[0], command[2] if reverse else command[3])
+            self.cur_object = rows[0]
+        elif kind == 'move':
+            obj = self.objects[rows[0]]
+            old = self.bounds_rect(obj)
+            obj.coords = (command[2] if reverse else command[3]).copy()
+            self.object_index.update(obj, obj.bounds())
+            self.redraw_objects(old.united(self.bounds_rect(obj)))
+            self.cur_object = rows[0]
+        self.parent.select_object(self.cur_object)
+        self.update()
+        self.auto_export_json()
+
+    def auto_segment(self, left_x, left_y, right_x, right_y):
+        key = self.cache_key('segment', (left_x, left_y, right_x, right_y))
+        return self.polygon_cache.cached(key, lambda: self.run_pipeline('segment', left_x, left_y, right_x, right_y))
+
+    def cache_key(self, kind, rect):
+        # waits if the image is still being hashed
+        return PolygonCache.key(self.image_hash_future.result(), kind, rect, pipeline().params())
+
+    def run_pipeline(self, kind, left_x, left_y, right_x, right_y):
+        # kind is 'main' (largest paragraph) or 'segment' (every paragraph)
+        if pipeline().THRESHOLD == 'global':
+            # waits if the page is still being indexed
+            return getattr(self.page_index_future.result(), kind)(left_x, left_y, right_x, right_y)
+        return getattr(pipeline(), kind)(self.cv2_image[left_y:right_y, left_x:right_x])
+
+    def request_preview(self, kind, rect):
+        if rect[2] - rect[0] < 2 or rect[3] - rect[1] < 2 or self.cv2_image is None:
+            return
+        if self.confirmed:
+            # the confirmed preview must not be replaced before it is added
+            return
+        if self.preview_key != (kind, rect):
+            self.preview_key = (kind, rect)
+            self.preview = None
+            self.preview_worker.request(self.preview_key, lambda: self.cached_preview(kind, rect))
+
+    def cached_preview(self, kind, rect):
+        # on the preview thread; only confirmed results are put in the cache
+        polygons = self.polygon_cache.get(self.cache_key(kind, rect))
+        return self.run_pipeline(kind, *rect) if polygons is None else polygons
+
+    def show_preview(self, key, result):
+        if key == self.preview_key:
+            self.preview = result
+            if self.confirmed:
+                self.add_preview()
+            elif self.band_rect() is not None:
+                self.update(self.to_widget(self.band_rect()))
+
+    def confirm_preview(self, kind, rect):
+        """
+            Second click: add the objects of the preview of rect, now if it
+            is ready, otherwise when the preview thread delivers it
+        """
+        if self.confirmed:
+            # still waiting for the last one
+            return
+        self.request_preview(kind, rect)
+        if self.preview_key != (kind, rect):
+            # region too small for a preview
+            self.clear_preview()
+            return
+        self.confirmed = True
+        if self.preview is not None:
+            self.add_preview()
+
+    def add_preview(self):
+        (kind, rect), polygons = self.preview_key, self.preview
+        self.polygon_cache.put(self.cache_key(kind, rect), polygons)
+        self.clear_preview()
+        if kind == 'segment':
+            self.add_polygons(polygons, rect[0], rect[1])
+        elif len(polygons) > 0:
+            text = self.labelDialog.pop_up()
+            self.add_obj(Polygon(np.asarray(polygons, dtype=np.float64) + (rect[0], rect[1]), text))
+
+    def clear_preview(self):
+        self.preview_worker.cancel()
+        self.preview_key = None
+        self.preview = None
+        self.confirmed = False
+        self.cursor_pos = None
+
+    def preview_polygons(self):
+        kind, (left_x, left_y, _, _) = self.preview_key
+        polygons = [self.preview] if kind == 'main' else self.preview
+        return [shape.to_polygon(np.asarray(polygon, dtype=np.float64).reshape(-1, 2) + (left_x, left_y)) for polygon in polygons]
+
+    def auto_segment_page(self):
+        if self.cv2_image is not None:
+            h, w = self.cv2_image.shape[:2]
+            self.add_polygons(self.auto_segment(0, 0, w, h))
 
     def auto_export_json(self):
+        # saved by flush_labels once edits pause for AUTOSAVE_DELAY
+        self.dirty = True
+        self.save_timer.start()
+
+    def flush_labels(self):
+        self.save_timer.stop()
+        if not self.dirty:
+            return
+        self.dirty = False
+
         data = {}
         data['date'] = str(datetime.datetime.now())
         data['objects'] = []
@@ -127,11 +458,174 @@ class Canvas(QWidget):
             obj.export_json(data_obj)
             data['objects'].append(data_obj)
 
-        with open(self.label_dir, 'w') as json_file:
-            json.dump(data, json_file)
-        
-        self.parent.load_file_list()
-        self.parent.file_list_widget.setCurrentRow(self.parent.file_id)
+        self.label_writer.write(self.label_dir, data)
+
+    def label_saved(self, label_dir):
+        self.parent.set_labelled(label_dir)
+
+    def invalidate_background(self):
+        self.background = None
+        self.invalidate_objects()
+
+    def invalidate_objects(self):
+        self.object_layer = None
+        self.update()
+
+    def objects_inserted(self, parent, first, last):
+        for obj in self.objects[first:last + 1]:
+            self.object_index.insert(obj, obj.bounds())
+        # new objects are drawn onto the cached layer, no need to redraw all
+        if self.object_layer is not None:
+            self.draw_objects(self.object_layer, self.objects[first:last + 1])
+        self.update()
+
+    def objects_removing(self, parent, first, last):
+        for obj in self.objects[first:last + 1]:
+            rect = self.bounds_rect(obj)
+            self.removed_rect = rect if self.removed_rect is None else self.removed_rect.united(rect)
+            self.object_index.remove(obj)
+            if obj is self.hover_object:
+                self.hover_object = None
+
+    def objects_removed(self, parent, first, last):
+        rect, self.removed_rect = self.removed_rect, None
+        self.redraw_objects(rect)
+
+    def objects_reset(self):
+        self.object_index.clear()
+        for obj in self.objects:
+            self.object_index.insert(obj, obj.bounds())
+        self.hover_object = None
+        self.drag = None
+        self.invalidate_objects()
+
+    def draw_objects(self, layer, objects, clip=None):
+        p = QPainter(layer)
+        p.setRenderHint(QPainter.Antialiasing)
+        if clip is not None:
+            p.setClipRect(clip)
+        p.scale(self.scale, self.scale)
+        pen = QPen()
+        pen.setWidthF(2 / self.scale)
+        p.setPen(pen)
+        p.setBrush(QColor(255, 0, 0, 0))
+        for obj in objects:
+            obj.draw(p)
+        p.end()
+
+    def redraw_objects(self, rect):
+        """
+            Clear the part of the object layer under rect (image
+            coordinates) and draw again only the objects overlapping it,
+            instead of the whole layer
+        """
+        if self.object_layer is None:
+            self.update()
+            return
+        s = self.scale
+        area = QRectF(rect.topLeft() * s, rect.size() * s).toAlignedRect().adjusted(-3, -3, 3, 3)
+        dragged = self.drag[0] if self.drag is not None and self.drag[3] else None
+        # outlines reach a pen width outside their boxes
+        outer = area.adjusted(-3, -3, 3, 3)
+        objects = [obj for obj in self.object_index.overlapping(
+                       outer.left() / s, outer.top() / s, (outer.right() + 1) / s, (outer.bottom() + 1) / s)
+                   if obj is not dragged]
+        p = QPainter(self.object_layer)
+        p.setCompositionMode(QPainter.CompositionMode_Clear)
+        p.fillRect(area, Qt.transparent)
+        p.end()
+        self.draw_objects(self.object_layer, objects, clip=area)
+        self.update(self.to_widget(rect))
+
+    def cache_layers(self):
+        """
+            Build the image scaled to the current zoom and a transparent layer
+            with the outlines of all objects, unless they would be too big.
+            Images with a pyramid are always drawn from their tiles.
+        """
+        w = int(round(self.pixmap.width() * self.scale))
+        h = int(round(self.pixmap.height() * self.scale))
+        if w * h > MAX_CACHED_PIXELS or w == 0 or h == 0:
+            self.background = self.object_layer = None
+            return
+        if self.background is None and self.pyramid is None:
+            self.background = QPixmap.fromImage(
+                self.pixmap.scaled(w, h, Qt.IgnoreAspectRatio, Qt.SmoothTransformation))
+        if self.object_layer is None:
+            self.object_layer = QPixmap(w, h)
+            self.object_layer.fill(Qt.transparent)
+            # an object being dragged is drawn live instead
+            dragged = self.drag[0] if self.drag is not None and self.drag[3] else None
+            self.draw_objects(self.object_layer, [obj for obj in self.objects if obj is not dragged])
+
+    def draw_image(self, p, rect):
+        """
+            Draw the part of the image under the widget rectangle rect, p
+            paints in image coordinates. With a pyramid only the visible
+            tiles of the level matching the zoom are drawn; tiles not made
+            yet are requested from the tile thread and meanwhile drawn
+            from a coarser level if one is ready.
+        """
+        w, h = self.pixmap.width(), self.pixmap.height()
+        visible = QRectF(self.transform_pos(QPointF(rect.topLeft())),
+                         self.transform_pos(QPointF(rect.bottomRight()) + QPointF(1, 1)))
+        visible = visible.intersected(QRectF(0, 0, w, h))
+        level = 0 if self.pyramid is None else self.pyramid.level_for(self.scale)
+        if level == 0:
+            p.drawImage(visible, self.pixmap, visible)
+            return
+
+        wanted = set()
+        for tx, ty in self.pyramid.tiles(level, visible.left(), visible.top(), visible.right() + 1, visible.bottom() + 1):
+            size = TILE * 2 ** level
+            target = QRectF(tx * size, ty * size, size, size).intersected(QRectF(0, 0, w, h))
+            wanted.add((level, tx, ty))
+            for k in range(level, len(self.pyramid.sizes)):
+                d = k - level
+                image = self.tile_image(k, tx >> d, ty >> d, request=(k == level))
+                if image is not None:
+                    origin = QPointF((tx >> d) * TILE, (ty >> d) * TILE) * 2 ** k
+                    source = QRectF((target.topLeft() - origin) / 2 ** k, target.size() / 2 ** k)
+                    p.drawImage(target, image, source)
+                    break
+        for key in list(self.tile_futures):
+            if self.tile_futures[key].done() or key not in wanted and self.tile_futures[key].cancel():
+                del self.tile_futures[key]
+
+    def tile_image(self, level, tx, ty, request=False):
+        # the tile as a QImage if it is made, else None (and made if request)
+        key = (level, tx, ty)
+        if key in self.tile_images:
+            self.tile_images.move_to_end(key)
+            return self.tile_images[key][0]
+        if not self.pyramid.ready(level, tx, ty):
+            if request and key not in self.tile_futures:
+                self.tile_futures[key] = self.tile_pool.submit(self.make_tile, self.pyramid, key)
+            return None
+        tile = np.ascontiguousarray(self.pyramid.tile(level, tx, ty))
+        image = QImage(tile.data, tile.shape[1], tile.shape[0], tile.strides[0], QImage.Format_RGB32)
+        # the QImage does not own its buffer, keep both
+        self.tile_images[key] = (image, tile)
+        while len(self.tile_images) > MAX_TILE_IMAGES:
+            self.tile_images.popitem(last=False)
+        return image
+
+    def make_tile(self, pyramid, key):
+        pyramid.tile(*key)
+        self.tile_ready.emit()
+
+    def to_widget(self, rect):
+        # image coordinates to the widget pixels they cover, with a margin
+        # for the pen and the padding of auto-polygons
+        rect = rect.adjusted(-4, -4, 4, 4)
+        s = self.scale
+        rect = QRectF((rect.topLeft() + self.offset_to_center()) * s, rect.size() * s)
+        return rect.toAlignedRect().adjusted(-2, -2, 2, 2)
+
+    def band_rect(self):
+        if self.cursor_pos is None or len(self.points) != 1:
+            return None
+        return QRectF(self.points[0], self.cursor_pos).normalized()
 
     def paintEvent(self, event):
         if self.pixmap == None:
@@ -141,23 +635,42 @@ class Canvas(QWidget):
         p.begin(self)
 
         p.setRenderHint(QPainter.Antialiasing)
-        p.setRenderHint(QPainter.HighQualityAntialiasing)
-        p.setRenderHint(QPainter.SmoothPixmapTransform)
 
+        self.cache_layers()
+        origin = self.offset_to_center() * self.scale
+        if self.background is not None:
+            p.drawPixmap(origin, self.background)
+        else:
+            p.save()
+            p.setRenderHint(QPainter.SmoothPixmapTransform)
+            p.scale(self.scale, self.scale)
+            p.translate(self.offset_to_center())
+            self.draw_image(p, event.rect())
+            p.restore()
+        if self.object_layer is not None:
+            p.drawPixmap(origin, self.object_layer)
         p.scale(self.scale, self.scale)
         p.translate(self.offset_to_center())
-        p.drawPixmap(0, 0, self.pixmap)
 
         pen = QPen()
-        pen.setWidth(2 / self.scale)
+        pen.setWidthF(2 / self.scale)
         p.setPen(pen)
 
-        for i, obj in enumerate(self.objects):
-            if self.cur_object == i:
-                p.setBrush(QColor(255, 0, 0, 100))
-            else:
-                p.setBrush(QColor(255, 0, 0, 0))
-            obj.draw(p)
+        if self.object_layer is None:
+            p.setBrush(QColor(255, 0, 0, 0))
+            for obj in self.objects:
+                obj.draw(p)
+
+        if self.hover_object is not None:
+            p.setBrush(QColor(255, 0, 0, 40))
+            self.hover_object.draw(p)
+
+        if 0 <= self.cur_object < len(self.objects):
+            p.setBrush(QColor(255, 0, 0, 100))
+            self.objects[self.cur_object].draw(p)
+            if self.mode == self.SELECT:
+                for handle in self.objects[self.cur_object].handles():
+                    p.drawEllipse(handle, 3 / self.scale, 3 / self.scale)
 
         if self.mode != self.SELECT:
             for point in self.points:
@@ -165,14 +678,26 @@ class Canvas(QWidget):
             for i in range(len(self.points) - 1):
                 p.drawLine(self.points[i], self.points[i + 1])
 
+        if self.band_rect() is not None:
+            p.setBrush(QColor(255, 0, 0, 0))
+            pen.setStyle(Qt.DashLine)
+            p.setPen(pen)
+            p.drawRect(self.band_rect())
+            if self.preview is not None:
+                p.setBrush(QColor(0, 0, 255, 60))
+                for polygon in self.preview_polygons():
+                    p.drawPolygon(polygon)
+
         p.end()
 
     def mousePressEvent(self, event):
-        if event.button() == Qt.LeftButton:
+        if event.button() == Qt.LeftButton and self.mode == self.SELECT and self.pixmap is not None:
+            self.start_drag(self.transform_pos(event.localPos()))
+        elif event.button() == Qt.LeftButton:
             pos = self.transform_pos(event.localPos())
             if self.in_pixmap(pos):
                 self.points.append(pos)
-                self.repaint()
+                self.update()
 
                 if self.mode == self.RECTANGLE and len(self.points) == 2:
                     left_x = int(min(self.points[0].x(), self.points[1].x()))
@@ -184,21 +709,114 @@ class Canvas(QWidget):
                     self.add_obj(Rectangle(self.points, text))
                     self.points = []
 
-                if self.mode == self.AUTO_POLYGON and len(self.points) == 2:
-                    left_x = int(min(self.points[0].x(), self.points[1].x()))
-                    right_x = int(max(self.points[0].x(), self.points[1].x()))
-                    left_y = int(min(self.points[0].y(), self.points[1].y()))
-                    right_y = int(max(self.points[0].y(), self.points[1].y()))
-
-                    tmp = rectilinear_polygon.main(self.cv2_image[left_y:right_y, left_x:right_x])
-                    points = [QPointF(left_x + x, left_y + y) for x, y in tmp]
-                    if (len(points) > 0):
-                        text = self.labelDialog.pop_up()
-                        self.add_obj(Polygon(points, text))
+                if self.mode in (self.AUTO_POLYGON, self.AUTO_SEGMENT) and len(self.points) == 2:
+                    kind = 'main' if self.mode == self.AUTO_POLYGON else 'segment'
+                    rect = self.region(self.points[0], self.points[1])
                     self.points = []
+                    self.confirm_preview(kind, rect)
 
                 if self.mode == self.POLYGON and len(self.points) >= 4 \
                         and self.close_enough(self.points[0], self.points[-1]):
                     text = self.labelDialog.pop_up()
                     self.add_obj(Polygon(self.points[:-1], text))
-                    self.points = []
\ No newline at end of file
+                    self.points = []
+
+    def mouseMoveEvent(self, event):
+        if self.pixmap is not None and self.mode == self.SELECT:
+            pos = self.transform_pos(event.localPos())
+            if self.drag is not None and event.buttons() & Qt.LeftButton:
+                self.drag_to(pos)
+            else:
+                self.hover(pos)
+            return
+        if self.pixmap is None or len(self.points) != 1 or \
+                self.mode not in (self.AUTO_POLYGON, self.AUTO_SEGMENT):
+            return
+        pos = self.transform_pos(event.localPos())
+        if self.in_pixmap(pos):
+            # only the old and the new rubber band (with the preview inside) change
+            old_band = self.band_rect()
+            self.cursor_pos = pos
+            kind = 'main' if self.mode == self.AUTO_POLYGON else 'segment'
+            self.request_preview(kind, self.region(self.points[0], pos))
+            if old_band is not None:
+                self.update(self.to_widget(old_band))
+            self.update(self.to_widget(self.band_rect()))
+
+    def mouseReleaseEvent(self, event):
+        if event.button() == Qt.LeftButton and self.drag is not None:
+            obj, _, _, moved, coords = self.drag
+            self.drag = None
+            if moved:
+                obj.normalize()
+                self.history.push(self.label_dir, ('move', self.objects.index(obj), coords, obj.coords.copy()))
+                self.object_index.update(obj, obj.bounds())
+                self.invalidate_objects()
+                self.auto_export_json()
+
+    def bounds_rect(self, obj):
+        x1, y1, x2, y2 = obj.bounds()
+        return QRectF(QPointF(x1, y1), QPointF(x2, y2))
+
+    def object_at(self, pos):
+        """
+            Row of the object under pos, -1 if none. Polygons are hit inside
+            or on their outline; of nested objects the smallest one wins.
+        """
+        margin = 4 / self.scale
+        best, best_area = None, None
+        for obj in self.object_index.at(pos.x(), pos.y(), margin):
+            if obj.contains(pos, margin):
+                x1, y1, x2, y2 = self.object_index.boxes[obj]
+                area = (x2 - x1) * (y2 - y1)
+                if best is None or area < best_area:
+                    best, best_area = obj, area
+        return -1 if best is None else self.objects.index(best)
+
+    def handle_at(self, obj, pos):
+        margin = 5 / self.scale
+        for i, handle in enumerate(obj.handles()):
+            if abs(handle.x() - pos.x()) <= margin and abs(handle.y() - pos.y()) <= margin:
+                return i
+        return -1
+
+    def hover(self, pos):
+        row = self.object_at(pos)
+        obj = self.objects[row] if row >= 0 else None
+        if obj is not self.hover_object:
+            for old in (self.hover_object, obj):
+                if old is not None:
+                    self.update(self.to_widget(self.bounds_rect(old)))
+            self.hover_object = obj
+
+    def start_drag(self, pos):
+        # a handle of the current object resizes it, a click on an object
+        # selects it and starts moving it
+        handle = -1
+        if 0 <= self.cur_object < len(self.objects):
+            handle = self.handle_at(self.objects[self.cur_object], pos)
+        row = self.cur_object if handle >= 0 else self.object_at(pos)
+        if row < 0:
+            return
+        if row != self.cur_object:
+            self.cur_object = row
+            self.parent.select_object(row)
+        self.drag = [self.objects[row], handle, pos, False, self.objects[row].coords.copy()]
+
+    def drag_to(self, pos):
+        obj, handle, last, moved, coords = self.drag
+        w, h = self.pixmap.width(), self.pixmap.height()
+        old = self.bounds_rect(obj)
+        if handle >= 0:
+            obj.move_handle(handle, QPointF(min(max(pos.x(), 0), w), min(max(pos.y(), 0), h)))
+        else:
+            # the whole object stays on the image
+            x1, y1, x2, y2 = obj.bounds()
+            dx = min(max(pos.x() - last.x(), -x1), w - x2)
+            dy = min(max(pos.y() - last.y(), -y1), h - y2)
+            obj.translate(dx, dy)
+        self.drag = [obj, handle, pos, True, coords]
+        if not moved:
+            # redraw the layer once without it, then only the dirty rect
+            self.invalidate_objects()
+        self.update(self.to_widget(old).united(self.to_widget(self.bounds_rect(obj))))
@@ -0,0 +1,58 @@
+from qtpy.QtCore import QObject, Signal
+
+import os
+import threading
+
+# images reported per found signal while a directory is being read
+BATCH = 1000
+
+class DirScanner(QObject):
+    """
+        List the images of a directory (and its subdirectories) on a
+        background thread, reading every directory exactly once.
+
+        found(generation, images, labels) streams image paths in batches;
+        label files are reported once their directory is fully read.
+        finished(generation, label_names) follows the last batch with the
+        label file names of every directory read. A new scan
+        makes the running one stop, compare generation to drop its signals.
+    """
+    found = Signal(int, list, list)
+    finished = Signal(int, dict)
+
+    def __init__(self):
+        super(DirScanner, self).__init__()
+        self.generation = 0
+
+    def scan(self, root, exts, recursive=False):
+        self.generation += 1
+        thread = threading.Thread(target=self.run, args=(self.generation, root, set(exts), recursive), daemon=True)
+        thread.start()
+        return self.generation
+
+    def run(self, generation, root, exts, recursive):
+        dirs, label_names = [root], {}
+        while len(dirs) > 0:
+            image_dir = dirs.pop()
+            images, labels = [], []
+            try:
+                with os.scandir(image_dir) as entries:
+                    for entry in entries:
+                        if generation != self.generation:
+                            return
+                        ext = os.path.splitext(entry.name)[1][1:].lower()
+                        if ext in exts:
+                            images.append(entry.path)
+                        elif ext == 'json':
+                            labels.append(entry.path)
+                        elif recursive and entry.is_dir(follow_symlinks=False):
+                            dirs.append(entry.path)
+                        if len(images) >= BATCH:
+                            self.found.emit(generation, images, [])
+                            images = []
+            except OSError:
+                continue
+            label_names[image_dir] = {os.path.basename(label) for label in labels}
+            self.found.emit(generation, images, labels)
+        if generation == self.generation:
+            self.finished.emit(generation, label_names)
@@ -0,0 +1,71 @@
+from qtpy.QtCore import QAbstractListModel, QModelIndex, Qt
+
+from label_files import label_path
+
+import re
+
+def natural_key(path):
+    # 'page_2.png' before 'page_10.png'
+    return [int(part) if part.isdigit() else part.lower() for part in re.split(r'(\d+)', path)]
+
+class FileListModel(QAbstractListModel):
+    """
+        Image paths and whether each has a label file. The view only asks for
+        the rows it draws, so a directory of 100k images is one Python list,
+        and a label status change repaints a single row.
+    """
+    def __init__(self, parent=None):
+        super(FileListModel, self).__init__(parent)
+        self.files = []
+        self.labelled = set()
+        self.label_rows = {}
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.files)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        image_dir = self.files[index.row()]
+        if role == Qt.DisplayRole:
+            return image_dir
+        if role == Qt.CheckStateRole:
+            return Qt.Checked if image_dir in self.labelled else Qt.Unchecked
+        return None
+
+    def flags(self, index):
+        return Qt.ItemIsEnabled | Qt.ItemIsSelectable
+
+    def set_files(self, files, labelled=()):
+        """
+            Show files (the list is kept, not copied, appends go into it),
+            labelled are the image paths that have a label file
+        """
+        self.beginResetModel()
+        self.files = files
+        self.labelled = set(labelled)
+        self.label_rows = {label_path(image_dir): row for row, image_dir in enumerate(files)}
+        self.endResetModel()
+
+    def append_files(self, files):
+        if len(files) == 0:
+            return
+        self.beginInsertRows(QModelIndex(), len(self.files), len(self.files) + len(files) - 1)
+        for image_dir in files:
+            self.label_rows[label_path(image_dir)] = len(self.files)
+            self.files.append(image_dir)
+        self.endInsertRows()
+
+    def set_labelled(self, label_dir, labelled=True):
+        row = self.label_rows.get(label_dir)
+        if row is None:
+            return
+        image_dir = self.files[row]
+        if (image_dir in self.labelled) == labelled:
+            return
+        if labelled:
+            self.labelled.add(image_dir)
+        else:
+            self.labelled.discard(image_dir)
+        index = self.index(row)
+        self.dataChanged.emit(index, index, [Qt.CheckStateRole])
@@ -1,24 +1,32 @@
 from qtpy.QtWidgets import \
-    QLineEdit, QCompleter, QVBoxLayout, QDialogButtonBox, QDialog, QListWidget
-from qtpy.QtCore import QStringListModel, QRegExp, Qt
+    QLineEdit, QVBoxLayout, QDialogButtonBox, QDialog, QListView
+from qtpy.QtCore import QRegExp, Qt
 from qtpy.QtGui import QRegExpValidator, QIcon, QCursor
 
+from label_index import LabelIndex
+from widgets.label_list_model import LabelListModel
+
 BB = QDialogButtonBox
 
 class LabelDialog(QDialog):
-    def __init__(self, text="Enter object label", parent=None, listItem=None):
+    def __init__(self, text="Enter object label", parent=None, listItem=None, label_index=None):
+        """
+            listItem is a list of labels, or pass the LabelIndex of them
+            (built once and shared) as label_index. Typing filters the
+            list, Up / Down pick a label from it.
+        """
         super(LabelDialog, self).__init__(parent)
 
         self.edit = QLineEdit()
         self.edit.setText(text)
         self.edit.setValidator(self.label_validator())
         self.edit.editingFinished.connect(self.post_process)
+        self.edit.textEdited.connect(self.search)
 
-        model = QStringListModel()
-        model.setStringList(listItem)
-        completer = QCompleter()
-        completer.setModel(model)
-        self.edit.setCompleter(completer)
+        if label_index is None and listItem is not None:
+            label_index = LabelIndex(listItem)
+        self.label_index = label_index
+        self.listView = None
 
         layout = QVBoxLayout()
         layout.addWidget(self.edit)
@@ -29,13 +37,18 @@ class LabelDialog(QDialog):
         bb.rejected.connect(self.reject)
         layout.addWidget(bb)
 
-        if listItem is not None and len(listItem) > 0:
-            self.listWidget = QListWidget(self)
-            for item in listItem:
-                self.listWidget.addItem(item)
-            self.listWidget.itemClicked.connect(self.listItemClick)
-            self.listWidget.itemDoubleClicked.connect(self.listItemDoubleClick)
-            layout.addWidget(self.listWidget)
+        if label_index is not None and len(label_index) > 0:
+            # only the visible rows are drawn and the rest are laid out in
+            # batches between events, whatever the number of labels
+            self.model = LabelListModel(self)
+            self.model.set_index(label_index)
+            self.listView = QListView(self)
+            self.listView.setUniformItemSizes(True)
+            self.listView.setLayoutMode(QListView.Batched)
+            self.listView.setModel(self.model)
+            self.listView.clicked.connect(self.listItemClick)
+            self.listView.doubleClicked.connect(self.listItemDoubleClick)
+            layout.addWidget(self.listView)
 
         self.setLayout(layout)
 
@@ -56,22 +69,39 @@ class LabelDialog(QDialog):
         except AttributeError:
             self.edit.setText(self.edit.text())
 
+    def search(self, text):
+        if self.listView is None:
+            return
+        self.model.set_rows(self.label_index.search(text))
+        self.listView.scrollToTop()
+
+    def keyPressEvent(self, event):
+        # the line edit keeps the focus, arrows move in the list
+        steps = {Qt.Key_Up: -1, Qt.Key_Down: 1, Qt.Key_PageUp: -10, Qt.Key_PageDown: 10}
+        if self.listView is None or event.key() not in steps or self.model.rowCount() == 0:
+            return super(LabelDialog, self).keyPressEvent(event)
+        row = self.listView.currentIndex().row()
+        row = 0 if row < 0 else min(max(row + steps[event.key()], 0), self.model.rowCount() - 1)
+        self.listView.setCurrentIndex(self.model.index(row))
+        self.listItemClick(self.model.index(row))
+
     def pop_up(self, text='', move=True):
         self.edit.setText(text)
         self.edit.setSelection(0, len(text))
         self.edit.setFocus(Qt.PopupFocusReason)
+        # every label, recently used ones first
+        self.search('')
         if move:
             self.move(QCursor.pos())
-        return self.edit.text() if self.exec_() else None
+        if not self.exec_():
+            return None
+        if self.label_index is not None:
+            self.label_index.use(self.edit.text())
+        return self.edit.text()
 
-    def listItemClick(self, tQListWidgetItem):
-        try:
-            text = tQListWidgetItem.text().trimmed()
-        except AttributeError:
-            # PyQt5: AttributeError: 'str' object has no attribute 'trimmed'
-            text = tQListWidgetItem.text().strip()
-        self.edit.setText(text)
+    def listItemClick(self, index):
+        self.edit.setText(self.model.label(index.row()).strip())
 
-    def listItemDoubleClick(self, tQListWidgetItem):
-        self.listItemClick(tQListWidgetItem)
+    def listItemDoubleClick(self, index):
+        self.listItemClick(index)
         self.validate()
\ No newline at end of file
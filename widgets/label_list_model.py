@@ -0,0 +1,37 @@
+from qtpy.QtCore import QAbstractListModel, QModelIndex, Qt
+
+import numpy as np
+
+class LabelListModel(QAbstractListModel):
+    """
+        Rows of a LabelIndex, all of them or the results of a search. The
+        view only asks for the rows it draws, so a taxonomy of 20k labels
+        is one array of row numbers instead of 20k list items.
+    """
+    def __init__(self, parent=None):
+        super(LabelListModel, self).__init__(parent)
+        self.label_index = None
+        self.rows = np.zeros(0, np.int64)
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if index.isValid() and role == Qt.DisplayRole:
+            return self.label(index.row())
+        return None
+
+    def flags(self, index):
+        return Qt.ItemIsEnabled | Qt.ItemIsSelectable
+
+    def label(self, row):
+        return self.label_index.labels[self.rows[row]]
+
+    def set_index(self, label_index):
+        self.label_index = label_index
+        self.set_rows(np.arange(len(label_index)))
+
+    def set_rows(self, rows):
+        self.beginResetModel()
+        self.rows = rows
+        self.endResetModel()
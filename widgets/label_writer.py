@@ -0,0 +1,55 @@
+from qtpy.QtCore import QObject, Signal
+
+from label_files import write_json
+
+import sqlite3
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+class LabelWriter(QObject):
+    """
+        Write label files on a background thread, in the order they were
+        requested. Each file is written to a temporary file and renamed into
+        place, so a crash never leaves a truncated label file behind. With a
+        LabelStore the labels go to the store instead.
+        saved(path) is delivered on the GUI thread once a file is written.
+    """
+    saved = Signal(str)
+
+    def __init__(self, store=None):
+        super(LabelWriter, self).__init__()
+        self.store = store
+        self.pool = ThreadPoolExecutor(max_workers=1)
+        # latest data of every path not written yet
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    def write(self, path, data):
+        with self.lock:
+            self.pending[path] = data
+        self.pool.submit(self.write_now, path, data)
+
+    def pending_data(self, path):
+        # what path will contain once written, None if nothing is queued
+        with self.lock:
+            return self.pending.get(path)
+
+    def write_now(self, path, data):
+        try:
+            if self.store is not None:
+                self.store.put(path, data)
+            else:
+                write_json(path, data)
+        except (OSError, sqlite3.Error):
+            traceback.print_exc()
+            return
+        finally:
+            with self.lock:
+                if self.pending.get(path) is data:
+                    del self.pending[path]
+        self.saved.emit(path)
+
+    def wait(self):
+        # block until every write requested so far is on disk
+        self.pool.submit(lambda: None).result()
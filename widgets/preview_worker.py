@@ -0,0 +1,49 @@
+from qtpy.QtCore import QObject, Signal
+
+import threading
+import traceback
+
+class PreviewWorker(QObject):
+    """
+        Run one computation at a time on a background thread and only for
+        the latest request: a new request replaces the one still waiting,
+        and the result of a request that is no longer the latest is dropped.
+        done(key, result) is delivered on the GUI thread.
+    """
+    done = Signal(object, object)
+
+    def __init__(self):
+        super(PreviewWorker, self).__init__()
+        self.cond = threading.Condition()
+        self.pending = None
+        self.latest = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def request(self, key, compute):
+        with self.cond:
+            self.latest = key
+            self.pending = (key, compute)
+            self.cond.notify()
+
+    def cancel(self):
+        with self.cond:
+            self.latest = None
+            self.pending = None
+
+    def run(self):
+        while True:
+            with self.cond:
+                while self.pending is None:
+                    self.cond.wait()
+                key, compute = self.pending
+                self.pending = None
+            try:
+                result = compute()
+            except Exception:
+                traceback.print_exc()
+                continue
+            with self.cond:
+                if key != self.latest:
+                    continue
+            self.done.emit(key, result)